@@ -0,0 +1,246 @@
+import os
+from core.timestamp import Timestamp
+
+
+class Event:
+    """A Dialogue/Comment line, start and end are integer centiseconds"""
+    __slots__ = ("kind", "start", "end", "text", "values")
+
+    def __init__(self, kind, start, end, text, values):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.text = text
+        self.values = values  # raw field values in the order of the [Events] Format line
+
+
+class Style:
+    __slots__ = ("name", "values")
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+
+
+class Section:
+    __slots__ = ("name", "lines")
+
+    def __init__(self, name, lines=None):
+        self.name = name
+        self.lines = lines if lines is not None else []
+
+
+class AssDocument:
+    """In-memory ASS/SSA document
+
+    the file is parsed once into sections (raw lines), a Styles table and Events,
+    edited in place by the Subtitle operations and written back with save().
+    """
+    styles_sections = ("V4+ Styles", "V4 Styles", "V4 Styles+")
+    events_section = "Events"
+    default_events_format = ["Layer", "Start", "End", "Style", "Name", "MarginL", "MarginR", "MarginV", "Effect", "Text"]
+
+    def __init__(self, path=None):
+        self.path = path
+        self.sections = []
+        self.styles_format = []
+        self.styles = []
+        self.events_format = list(self.default_events_format)
+        self.events = []
+        self.dirty = False
+        if path:
+            self.load(path)
+
+    @staticmethod
+    def split_format(value):
+        return [field.strip() for field in value.split(",")]
+
+    def load(self, path):
+        self.path = path
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            self.parse(file)
+        self.dirty = False
+        return self
+
+    def parse(self, lines):
+        section = None
+        indexes = self.event_indexes()
+        for line in lines:
+            line = line.rstrip("\r\n")
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = Section(stripped[1:-1])
+                self.sections.append(section)
+                continue
+            if section is None:
+                continue
+
+            if section.name in self.styles_sections:
+                key, _, value = stripped.partition(":")
+                if key == "Format":
+                    self.styles_format = self.split_format(value)
+                elif key == "Style":
+                    self.styles.append(self.parse_style(value))
+                elif stripped:
+                    section.lines.append(line)
+            elif section.name == self.events_section:
+                key, _, value = line.partition(":")
+                if key == "Format":
+                    self.events_format = self.split_format(value)
+                    indexes = self.event_indexes()
+                elif key in ("Dialogue", "Comment"):
+                    self.events.append(self.parse_event(key, value, indexes))
+                elif stripped:
+                    section.lines.append(line)
+            else:
+                section.lines.append(line)
+
+    def parse_style(self, value):
+        values = [field.strip() for field in value.split(",", max(len(self.styles_format) - 1, 0))]
+        return Style(values[0], values)
+
+    def event_indexes(self):
+        """Positions of Start, End and Text in the [Events] Format"""
+        return self.events_format.index("Start"), self.events_format.index("End"), self.events_format.index("Text")
+
+    def parse_event(self, kind, value, indexes=None):
+        start_index, end_index, text_index = indexes or self.event_indexes()
+        values = value.lstrip().split(",", len(self.events_format) - 1)
+        values.extend([""] * (len(self.events_format) - len(values)))
+        start = Timestamp.parse(values[start_index])
+        end = Timestamp.parse(values[end_index])
+        return Event(kind, start, end, values[text_index], values)
+
+    def event_line(self, event, indexes=None):
+        start_index, end_index, text_index = indexes or self.event_indexes()
+        values = list(event.values)
+        values[start_index] = Timestamp.format_ass(event.start)
+        values[end_index] = Timestamp.format_ass(event.end)
+        values[text_index] = event.text
+        return f"{event.kind}: {','.join(values)}"
+
+    def new_event(self, start, end, text, style="Default", kind="Dialogue"):
+        """Builds an event matching the document's [Events] Format"""
+        values = []
+        for field in self.events_format:
+            if field == "Style":
+                values.append(style)
+            elif field in ("Layer", "Marked", "MarginL", "MarginR", "MarginV"):
+                values.append("0")
+            else:
+                values.append("")
+        return Event(kind, start, end, text, values)
+
+    def section(self, name, before=None):
+        """Returns section by name, creates it (optionally before another section) if missing"""
+        for section in self.sections:
+            if section.name == name:
+                return section
+        section = Section(name)
+        index = len(self.sections)
+        if before:
+            for i, existing in enumerate(self.sections):
+                if existing.name == before:
+                    index = i
+                    break
+        self.sections.insert(index, section)
+        return section
+
+    def set_info(self, key, value):
+        """Sets a [Script Info] key, replacing an existing value"""
+        section = self.section("Script Info")
+        line = f"{key}: {value}"
+        for i, existing in enumerate(section.lines):
+            if existing.split(":", 1)[0].strip() == key:
+                section.lines[i] = line
+                return
+        index = len(section.lines)
+        while index > 0 and not section.lines[index - 1].strip():
+            index -= 1
+        section.lines.insert(index, line)
+
+    def lines(self):
+        events_written = False
+        indexes = self.event_indexes()
+        for section in self.sections:
+            yield f"[{section.name}]"
+            if section.name in self.styles_sections:
+                yield from section.lines
+                yield "Format: " + ", ".join(self.styles_format)
+                for style in self.styles:
+                    yield "Style: " + ",".join(style.values)
+                yield ""
+            elif section.name == self.events_section:
+                events_written = True
+                yield from section.lines
+                yield "Format: " + ", ".join(self.events_format)
+                for event in self.events:
+                    yield self.event_line(event, indexes)
+                yield ""
+            else:
+                yield from section.lines
+                if section.lines and section.lines[-1].strip():
+                    yield ""
+
+        if not events_written and self.events:
+            yield f"[{self.events_section}]"
+            yield "Format: " + ", ".join(self.events_format)
+            for event in self.events:
+                yield self.event_line(event, indexes)
+
+    @classmethod
+    def rewrite(cls, path, transform, output_path=None):
+        """Streams path line by line into output_path (path by default), passing every event through transform
+
+        only one event is in memory at a time, the output goes to a temp file renamed over the target.
+        transform returns the event to write or None to drop it.
+        """
+        document = cls()
+        indexes = document.event_indexes()
+        output_path = output_path or path
+        temp_path = f"{output_path}.tmp"
+        section = None
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as source, open(temp_path, 'w', encoding='utf-8') as target:
+                for line in source:
+                    stripped = line.strip()
+                    if stripped.startswith("[") and stripped.endswith("]"):
+                        section = stripped[1:-1]
+                    elif section == cls.events_section:
+                        key, _, value = line.partition(":")
+                        if key == "Format":
+                            document.events_format = document.split_format(value)
+                            indexes = document.event_indexes()
+                        elif key in ("Dialogue", "Comment"):
+                            event = transform(document.parse_event(key, value.rstrip("\r\n"), indexes))
+                            if event is not None:
+                                target.write(document.event_line(event, indexes) + "\n")
+                            continue
+                    target.write(line)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            cls.remove_temp(temp_path)
+            raise
+        return output_path
+
+    @staticmethod
+    def remove_temp(temp_path):
+        """Drops the temp file of a write that failed, the target is left as it was"""
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def save(self, path=None):
+        """Writes the document to path (defaults to the loaded file), through a temp file renamed over the target"""
+        path = path or self.path
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for line in self.lines():
+                    file.write(line + "\n")
+            os.replace(temp_path, path)
+        except BaseException:
+            self.remove_temp(temp_path)
+            raise
+        self.path = path
+        self.dirty = False
+        return path
@@ -0,0 +1,151 @@
+import os
+import time
+import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from core.utils import Utils
+from core.probe_cache import ProbeCache
+from core.tuning import Tuning
+from core import config
+
+
+def run_job(spec):
+    """Runs a single Video pipeline described by spec (executed inside a worker process)
+
+    subtitle steps run first on a Subtitle of the same media, "{subtitle}" in the Video steps'
+    arguments is then replaced by the resulting subtitle name e.g: ("hardcode_subtitle", {"subtitle": "{subtitle}"})
+    """
+    from core.video import Video
+    from core.subtitle import Subtitle
+
+    started = time.time()
+    result = {"media_path": spec["media_path"], "output": None, "duration": 0, "elapsed": 0, "error": None}
+    try:
+        subtitle_name = None
+        if spec.get("subtitle_steps"):
+            subtitle = Subtitle(spec["media_path"], spec["base_path"], spec["font_path"], show_log=spec["show_log"])
+            for method, kwargs in spec["subtitle_steps"]:
+                getattr(subtitle, method)(**kwargs)
+            subtitle_name = os.path.relpath(subtitle.return_path(), spec["base_path"])
+
+        video = Video(spec["media_path"], spec["font_path"], spec["fonts_dir"], base_path=spec["base_path"],
+                      show_log=spec["show_log"], jobs=spec.get("jobs", 1))
+        for method, kwargs in spec["steps"]:
+            kwargs = {key: subtitle_name if value == "{subtitle}" else value for key, value in kwargs.items()}
+            getattr(video, method)(**kwargs)
+
+        if video._trim:
+            result["duration"] = min(video._trim["end"], video.media_duration) - video._trim["start"]
+        else:
+            result["duration"] = video.media_duration
+
+        video.execute(progress_bar=False, async_run=False)
+        result["output"] = video.media_output_path
+        if video.move_path:
+            result["output"] = os.path.join(video.move_path, os.path.basename(video.media_output_path))
+    except Exception as e:
+        result["error"] = str(e)
+
+    result["elapsed"] = time.time() - started
+    result["probe_cache"] = ProbeCache().stats()
+    return result
+
+
+class Batch:
+    """Runs many Video pipelines at once on a bounded pool of worker processes
+
+    every job gets its own process so the Video singleton never leaks state between episodes.
+    """
+
+    def __init__(self, font_path, fonts_dir, base_path="assets/media", max_workers=None, show_log=False):
+        self.utils = Utils()
+        self.base_path = base_path
+        self.font_path = font_path
+        self.fonts_dir = fonts_dir
+        self.show_log = show_log
+        self.utils.check_folder(base_path)
+
+        # every job gets cores // max_workers encoder threads, keep about 4 per encode by default
+        self.max_workers = max_workers or max(1, Tuning().cpu_count() // 4)
+        self.jobs = []
+        self.results = []
+
+    def job(self, media_path, steps, subtitle_steps=None):
+        """Spec of a pipeline, what run_job receives"""
+        return {
+            "media_path": media_path,
+            "base_path": self.base_path,
+            "font_path": self.font_path,
+            "fonts_dir": self.fonts_dir,
+            "show_log": self.show_log,
+            "steps": list(steps),
+            "subtitle_steps": list(subtitle_steps or []),
+        }
+
+    def add(self, media_path, steps, subtitle_steps=None):
+        """Queues a pipeline
+
+        :media_path: str: media file name relative to base_path
+        :steps: list: (method, kwargs) pairs applied on Video in order e.g: [("trim", {"start": 0, "end": 20})]
+        :subtitle_steps: list: (method, kwargs) pairs applied on Subtitle before the Video steps
+            e.g: [("extract_subtitle", {}), ("remove_words", {"words_to_remove_from_subtitle": [".com"]})]
+        """
+        self.jobs.append(self.job(media_path, steps, subtitle_steps))
+        return self
+
+    def collect(self, steps, extensions=None, subtitle_steps=None):
+        """Queues the same pipeline for every media in base_path matching extensions"""
+        extensions = extensions or config.video_extensions
+        for file in sorted(os.listdir(self.base_path)):
+            if os.path.splitext(file)[1].lower() in extensions:
+                self.add(file, steps, subtitle_steps)
+        return self
+
+    def run(self):
+        if len(self.jobs) == 0:
+            raise ValueError("no job to run, use add or collect first")
+
+        self.results = []
+        started = time.time()
+        progress_bar = tqdm.tqdm(total=len(self.jobs), unit="job", desc="Batch", ascii=True)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, max_tasks_per_child=1) as executor:
+            jobs = min(self.max_workers, len(self.jobs))
+            futures = {executor.submit(run_job, {**job, "jobs": jobs}): job for job in self.jobs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # a worker died (e.g: killed out of memory), every job left in the pool fails with it
+                    result = {"media_path": futures[future]["media_path"], "output": None, "duration": 0, "elapsed": 0,
+                              "error": f"worker process crashed: {e}", "probe_cache": {"hits": 0, "misses": 0}}
+                self.results.append(result)
+                if result["error"]:
+                    progress_bar.write(f"Failed {result['media_path']}: {result['error']}")
+                progress_bar.update(1)
+
+        progress_bar.close()
+        self.jobs = []
+        return self.summary(time.time() - started)
+
+    def summary(self, elapsed):
+        succeeded = [result for result in self.results if not result["error"]]
+        media_seconds = sum(result["duration"] for result in succeeded)
+        elapsed = max(elapsed, 1e-6)
+
+        summary = {
+            "jobs": len(self.results),
+            "succeeded": len(succeeded),
+            "failed": len(self.results) - len(succeeded),
+            "elapsed": elapsed,
+            "jobs_per_hour": len(succeeded) / elapsed * 3600,
+            "speed": media_seconds / elapsed,
+            "probe_cache_hits": sum(result["probe_cache"]["hits"] for result in self.results),
+            "probe_cache_misses": sum(result["probe_cache"]["misses"] for result in self.results),
+        }
+
+        print(f"{summary['succeeded']}/{summary['jobs']} jobs done in "
+              f"{time.strftime('%H:%M:%S', time.gmtime(elapsed))} | "
+              f"{summary['jobs_per_hour']:.1f} jobs/hour | {summary['speed']:.2f}x realtime | "
+              f"probe cache {summary['probe_cache_hits']} hits/{summary['probe_cache_misses']} misses")
+        return summary
@@ -10,6 +10,18 @@ FONT = {
 video_extensions = ['.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm', '.mpeg', '.mpg', '.m4v']
 leading_zero = 2  # appends one 0 before video index name e.g: 01
 
+# ffprobe results are cached by path + size + mtime, least recently used entries are evicted past max_entries
+probe_cache = {
+    'path': os.path.abspath("assets/probe_cache.sqlite"),
+    'max_entries': 10000,
+    'content_hash': False,  # also hash first and last MiB of media, for filesystems with unreliable mtime
+}
+
+# measured encoding fps per encoder/resolution/preset/threads, Video picks the fastest known threading from it
+tuning = {
+    'path': os.path.abspath("assets/tuning.json"),
+}
+
 copy_right = [
     "mywebsite.com",  # website
     r"more to watch on mywebsite.com",  # start of video
@@ -17,5 +29,58 @@ copy_right = [
     r"more to watch on mywebsite.com",  # end of video
 ]
 
+# http downloads are split into this many range requests fetched at once, when the server accepts ranges
+downloader = {
+    'connections': 8,
+    'min_segment_size': 4 * 1024 * 1024,  # smaller files use fewer connections
+    'retries': 5,  # attempts per segment, a retry resumes where the segment stopped
+    'max_downloads': 3,  # links a DownloadManager downloads at the same time
+    'per_host_connections': 8,  # requests open to a host at once, across every download
+    'pool_hosts': 10,  # hosts the shared session keeps alive connections to
+}
+
+# magnet links and .torrent files run on one libtorrent session (core/torrent.py)
+torrent = {
+    'resume_path': os.path.abspath("assets/torrents"),
+    'resume_interval': 30,  # seconds between resume data saves of the running torrents
+    'keep_extensions': ['.srt', '.ass', '.ssa', '.vtt'],  # fetched along the video files, the rest of a torrent is skipped
+    'sequential': False,  # pieces in order, e.g. to watch or probe a video before it's complete
+    'seed': False,  # keep seeding finished torrents while the session runs
+    # libtorrent settings_pack
+    'settings': {
+        'listen_interfaces': '0.0.0.0:6881,[::]:6881',
+        'active_downloads': 3,  # torrents downloading at once, the others are queued
+        'active_seeds': 3,
+        'download_rate_limit': 0,  # bytes/s over every torrent, 0 is unlimited
+        'upload_rate_limit': 0,
+        'connections_limit': 200,
+        'enable_dht': True,
+    },
+}
+
+# translated dialogues are stored here and reused on reruns and across episodes
+translation_memory = {
+    'path': os.path.abspath("assets/translation_memory.sqlite"),
+}
+
 # include words you want to remove from text of extracted soft subtitle
 words_to_remove_from_subtitle = [".com"]
+
+# watch mode (core/watcher.py): every media that lands in the watched folder runs this pipeline
+watcher = {
+    'queue_path': os.path.abspath("assets/watch_queue.sqlite"),
+    'settle_seconds': 5,  # a file is picked once its size and mtime didn't change for this long (still downloading)
+    'poll_interval': 2,  # seconds between scans when inotify isn't available (pip install inotify_simple)
+    'max_workers': None,  # defaults to Batch's
+    'max_attempts': 2,  # failed jobs are retried until this many attempts
+    'subtitle_steps': [
+        ("extract_subtitle", {"index": 0}),
+        ("remove_words", {"words_to_remove_from_subtitle": words_to_remove_from_subtitle}),
+        ("customize_subtitle", {"sub_copyright": copy_right[0], "intro": copy_right[1], "opening": copy_right[2], "ending": copy_right[3]}),
+    ],
+    'steps': [
+        ("hardcode_subtitle", {"subtitle": "{subtitle}"}),
+        ("encode", {"resolution": "720", "codec": "h265"}),
+        ("move_file", {"path": "encoded"}),  # outputs leave the watched folder
+    ],
+}
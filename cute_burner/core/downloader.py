@@ -1,31 +1,130 @@
 import os
 import re
+import json
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_EXCEPTION
 from tqdm import tqdm
 from core.utils import Utils
+from core.torrent import TorrentEngine
+from core import config
 from urllib.parse import urlparse, urljoin, parse_qsl
-import libtorrent as lt
 import time
-import sys
 
 
-class Downloader:
+class DownloadProgress:
+    """Forwards byte counts to a tqdm bar at most every interval seconds, shared by the download threads"""
+
+    def __init__(self, pbar, interval):
+        self.pbar = pbar
+        self.interval = interval
+        self.pending = 0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, count):
+        with self.lock:
+            self.pending += count
+            now = time.monotonic()
+            if now - self.last >= self.interval:
+                self.pbar.update(self.pending)
+                self.pending = 0
+                self.last = now
+
+    def flush(self):
+        with self.lock:
+            self.pbar.update(self.pending)
+            self.pending = 0
+
+
+class CancelToken:
+    """Cancels the downloads it was given to, they stop at their next chunk"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_canceled(self):
+        return self.event.is_set()
+
+
+class HttpPool:
+    """requests.Session shared by every download, its connections are kept alive across requests and downloads
+
+    at most per_host requests run against a host at once, the others wait for a slot.
+    the first instance configures the pool, config.downloader by default.
+    """
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance.session = None
+            cls._instance.slots = {}
+            cls._instance.lock = threading.Lock()
         return cls._instance
 
-    def __init__(self, download_link, download_path="assets/media"):
+    def __init__(self, pool_hosts=None, per_host=None):
+        if self.session is None:
+            self.pool_hosts = pool_hosts or config.downloader['pool_hosts']
+            self.per_host = per_host or config.downloader['per_host_connections']
+            # retries are handled per segment by the Downloader
+            adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.per_host, max_retries=0)
+            self.session = requests.Session()
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+    def slot(self, url):
+        """Semaphore of the host of url, hold it while a request to it is open"""
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.slots[host]
+
+
+class Downloader:
+    # reads start at chunk_size and adapt between min and max to how fast the connection delivers
+    chunk_size = 256 * 1024
+    min_chunk_size = 64 * 1024
+    max_chunk_size = 1024 * 1024
+    progress_interval = 0.2
+
+    def __init__(self, download_link, download_path="assets/media", connections=None, checksum=None, hash_type=None,
+                 cancel_token=None):
+        """
+        :connections: int: parallel range requests for http downloads, defaults to config.downloader['connections'],
+            capped by the per host limit of the HttpPool
+        :checksum: str: expected digest (hex) of the downloaded file, verified once it's complete
+        :hash_type: str: hashlib name (sha256, sha1, md5...) or xxhash one (xxh64, xxh3_64, xxh3_128), sha256 by default
+            when a checksum is given. the file is hashed while it downloads, the hex digest is left in self.digest
+        :cancel_token: CancelToken: shared with other downloads to cancel them together, a new one by default
+
+        interrupted http downloads resume from the ranges recorded in <file>.download.json when run again.
+        the state of a finished download is kept, a file already on disk is only reused when its checksum matches
+        or the server still sends the ETag/Last-Modified recorded then.
+        """
         self.utils = Utils()
         self.download_path = download_path
         self.utils.check_folder(download_path)
+        self.link = download_link
         self.download_link = download_link
-        self.canceled = False
+        self.pool = HttpPool()
+        self.connections = min(connections or config.downloader['connections'], self.pool.per_host)
+        self.min_segment_size = config.downloader['min_segment_size']
+        self.retries = config.downloader['retries']
+        self.checksum = checksum
+        self.hash_type = hash_type or ("sha256" if checksum else None)
+        self.digest = None
+        self.cancel_token = cancel_token or CancelToken()
 
     def download(self):
-        if self.download_link.startswith("magnet:"):
+        if self.download_link.startswith("magnet:") or \
+                (self.download_link.endswith(".torrent") and os.path.isfile(self.download_link)):
             return self.download_torrent()
         else:
             return self.download_url()
@@ -60,70 +159,415 @@ class Downloader:
     def download_url(self):
         is_mrl, params = self.parse_link(self.download_link)
 
-        response = requests.get(self.download_link, stream=True, params=params)
+        # the host slot is held while streaming, a segmented download takes its own for every range request
+        with self.pool.slot(self.download_link):
+            # a compressed response's content-length is the encoded size, which can't be checked against the file
+            response = self.pool.session.get(self.download_link, stream=True, params=params,
+                                             headers={'Accept-Encoding': 'identity'})
 
-        if self.check_login_required(response):
-            raise ValueError("Login required to download the file.")
+            if self.check_login_required(response):
+                response.close()
+                raise ValueError("Login required to download the file.")
 
-        content_disposition = response.headers.get('content-disposition')
-        if content_disposition:
-            filename = re.findall(r'filename=(.+)', content_disposition)
-            if len(filename) > 0:
-                filename = filename[0].strip('"')
+            content_disposition = response.headers.get('content-disposition')
+            if content_disposition:
+                filename = re.findall(r'filename=(.+)', content_disposition)
+                if len(filename) > 0:
+                    filename = filename[0].strip('"')
+                else:
+                    filename = "unknown"
             else:
-                filename = "unknown"
-        else:
-            filename = urlparse(response.url).path.split('/')[-1]
-        filename = self.utils.append_prefix(filename, self.download_path)
-        self.utils.validate_file(filename, True)
+                filename = urlparse(response.url).path.split('/')[-1]
+            filename = self.utils.append_prefix(filename, self.download_path)
+
+            total = int(response.headers.get('content-length', 0))
+            if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+                total = 0
+            remote = {
+                "length": total,
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+            }
+            state = self.load_state(filename)
+            if self.already_downloaded(filename, state, remote):
+                response.close()
+                if not self.checksum:
+                    self.verify(filename, total)
+                return [filename]
+
+            segmented = self.ranges_supported(response)
+            if segmented:
+                response.close()
+            else:
+                self.utils.validate_file(self.state_path(filename), True)
+                finished, digest = self.download_stream(response, filename, total)
+
+        if segmented:
+            completed = []
+            if state and not state.get("finished") and {key: state.get(key) for key in remote} == remote \
+                    and os.path.exists(filename) \
+                    and os.path.getsize(filename) == total:
+                completed = state["completed"]
+            finished, digest = self.download_segments(response.url, filename, remote, completed)
+
+        if not finished:
+            self.utils.validate_file(filename, True)
+            self.utils.validate_file(self.state_path(filename), True)
+            return
+        self.verify(filename, total, digest)
+        self.save_state(filename, {**remote, "finished": True}, [[0, total]])
+        return [filename]
+
+    def already_downloaded(self, filename, state, remote):
+        """True when filename is a full download of remote: its checksum matches the expected one or, without one,
+        the state of its finished download records the same length, ETag and Last-Modified
+
+        a preallocated file of an unfinished download has the full size too, it is never hashed
+        """
+        if not remote["length"] or not os.path.exists(filename) or os.path.getsize(filename) != remote["length"]:
+            return False
+        if state and not state.get("finished"):
+            return False
+        if self.checksum:
+            self.digest = self.hash_file(filename).hexdigest()
+            return self.digest == self.checksum.lower()
+        return bool(state and state.get("finished") and (remote["etag"] or remote["last_modified"])
+                    and {key: state.get(key) for key in remote} == remote)
 
-        progress_bar = tqdm(
-            total=int(response.headers.get('content-length', 0)),
-            initial=0 if not os.path.exists(filename) else os.path.getsize(filename),
+    @staticmethod
+    def progress_bar(filename, total, initial=0):
+        return tqdm(
+            total=total, initial=initial,
             unit='B', unit_scale=True, desc=f"Downloading {filename}",
             bar_format='{desc} {percentage:3.0f}% |{rate_fmt}{postfix}'
         )
 
-        with open(filename, 'wb' if not os.path.exists(filename) else 'ab') as file, progress_bar as pbar:
-            for data in response.iter_content(chunk_size=1024):
-                if self.canceled:
-                    pbar.close()
-                    self.utils.validate_file(filename, True)
-                    return
-                file.write(data)
-                pbar.update(len(data))
-            return [filename]
+    @staticmethod
+    def ranges_supported(response):
+        if response.status_code != 200 or response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        if not int(response.headers.get('content-length', 0)):
+            return False
+        # ranges address the encoded bytes, they can't be stitched back after requests decodes them
+        return response.headers.get('Content-Encoding', 'identity').lower() == 'identity'
 
-    def download_torrent(self):
-        ses = lt.session()
-        ses.listen_on(6881, 6891)
+    def new_hash(self):
+        if self.hash_type.startswith("xxh"):
+            try:
+                import xxhash
+            except ImportError:
+                raise ValueError(f"pip install xxhash to use {self.hash_type} checksums")
+            if not hasattr(xxhash, self.hash_type):
+                raise ValueError(f"unknown xxhash type {self.hash_type}")
+            return getattr(xxhash, self.hash_type)()
+        try:
+            return hashlib.new(self.hash_type)
+        except ValueError:
+            raise ValueError(f"unknown hash type {self.hash_type}")
+
+    def hash_file(self, filename, digest=None, start=0, end=None):
+        """Feeds bytes start to end of filename to digest (a new one by default) through a reusable buffer"""
+        digest = digest or self.new_hash()
+        buffer = memoryview(bytearray(self.max_chunk_size))
+        with open(filename, 'rb', buffering=0) as file:
+            file.seek(start)
+            position = start
+            while end is None or position < end:
+                size = len(buffer) if end is None else min(len(buffer), end - position)
+                read = file.readinto(buffer[:size])
+                if not read:
+                    break
+                digest.update(buffer[:read])
+                position += read
+        return digest
 
-        params = {
-            'save_path': self.download_path,
-        }
-        handle = lt.add_magnet_uri(ses, self.download_link, params)
+    def verify(self, filename, total, digest=None):
+        """Checks the downloaded size and, when given, the checksum. a mismatching file is removed
 
-        while not handle.has_metadata():
-            time.sleep(1)
+        :digest: hash object computed while downloading, the file is only read again without one
+        """
+        error = None
+        if total and os.path.getsize(filename) != total:
+            error = f"expected {total} bytes, got {os.path.getsize(filename)}"
+        elif self.hash_type:
+            digest = digest or self.hash_file(filename)
+            self.digest = digest.hexdigest()
+            if self.checksum and self.digest != self.checksum.lower():
+                error = f"{self.hash_type} {self.digest} doesn't match {self.checksum}"
+        if error:
+            self.utils.validate_file(filename, True)
+            raise ValueError(f"{filename} is corrupted, {error}")
 
-        while handle.status().state != lt.torrent_status.seeding:
-            if self.canceled:
-                ses.pause()
+    def read_chunks(self, response, buffer):
+        """Yields memoryviews of buffer filled straight from the socket, valid until the next one is read
+
+        the read size doubles while reads fill up quickly and halves when they stall, so fast connections
+        make few large writes and slow ones still report progress. compressed responses are decoded by requests.
+        """
+        if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+            for data in response.iter_content(chunk_size=self.chunk_size):
+                yield memoryview(data)
+            return
+
+        size = self.chunk_size
+        while True:
+            started = time.monotonic()
+            read = response.raw.readinto(buffer[:size])
+            if not read:
                 return
-            s = handle.status()
-            print(f"\r{int(s.progress * 100)}% complete | {s.download_rate / (1024 * 1024):.1f} kB/s", end='')
-            sys.stdout.flush()
-            time.sleep(1)
+            yield buffer[:read]
+            elapsed = time.monotonic() - started
+            if read == size and elapsed < 0.05:
+                size = min(size * 2, len(buffer))
+            elif elapsed > 0.5:
+                size = max(size // 2, self.min_chunk_size)
 
-        return self.list_files_in_directory()
+    def download_stream(self, response, filename, total):
+        """Single connection download, used when the server doesn't accept ranges (and so can't resume)"""
+        buffer = memoryview(bytearray(self.max_chunk_size))
+        digest = self.new_hash() if self.hash_type else None
+        with open(filename, 'wb', buffering=0) as file, self.progress_bar(filename, total) as pbar:
+            progress = DownloadProgress(pbar, self.progress_interval)
+            for data in self.read_chunks(response, buffer):
+                if self.cancel_token.is_canceled():
+                    return False, None
+                file.write(data)
+                if digest:
+                    digest.update(data)
+                progress.update(len(data))
+            progress.flush()
+        return True, digest
+
+    @staticmethod
+    def state_path(filename):
+        return f"{filename}.download.json"
+
+    def load_state(self, filename):
+        path = self.state_path(filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save_state(self, filename, remote, completed):
+        path = self.state_path(filename)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({**remote, "completed": completed}, file)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def merge_ranges(ranges):
+        """Sorted, merged [start, end) byte ranges"""
+        merged = []
+        for start, end in sorted(ranges):
+            if end <= start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def missing_ranges(self, completed, total):
+        """[start, end) byte ranges still to fetch, split for up to self.connections requests"""
+        missing = []
+        position = 0
+        for start, end in self.merge_ranges(completed):
+            if start > position:
+                missing.append((position, start))
+            position = max(position, end)
+        if position < total:
+            missing.append((position, total))
+
+        remaining = sum(end - start for start, end in missing)
+        size = max(self.min_segment_size, -(-remaining // self.connections))
+        ranges = []
+        for start, end in missing:
+            ranges.extend((offset, min(offset + size, end)) for offset in range(start, end, size))
+        return ranges
+
+    @staticmethod
+    def preallocate(filename, size):
+        with open(filename, 'wb') as file:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(file.fileno(), 0, size)
+            else:
+                file.truncate(size)
+
+    @staticmethod
+    def write_at(file, data, offset):
+        if hasattr(os, 'pwrite'):
+            os.pwrite(file.fileno(), data, offset)
+        else:
+            file.seek(offset)
+            file.write(data)
+
+    def download_segments(self, url, filename, remote, completed):
+        """Fetches the missing byte ranges of url concurrently, each written at its offset of the preallocated file
+
+        the completed ranges are saved next to the file every few seconds and when stopping, If-Range makes
+        the server send the whole file instead of a range when it changed since, which aborts the download.
+        with a hash_type the file is hashed in order behind the writers, from the page cache, returns (finished, digest).
+        """
+        total = remote["length"]
+        if not completed:
+            # the state file comes first, a full size file is only reused when its state says it finished
+            self.save_state(filename, remote, [])
+            self.preallocate(filename, total)
+        ranges = self.missing_ranges(completed, total)
+        # byte offset reached by every range, what the state file records
+        offsets = [start for start, _ in ranges]
+        lock = threading.Lock()
+        stop = threading.Event()
+        headers = {'Accept-Encoding': 'identity'}
+        validator = remote["etag"] if remote["etag"] and not remote["etag"].startswith("W/") else remote["last_modified"]
+        if validator:
+            headers["If-Range"] = validator
+
+        def written():
+            with lock:
+                return self.merge_ranges(completed + [[start, offset] for (start, _), offset in zip(ranges, offsets)])
+
+        def checkpoint():
+            self.save_state(filename, remote, written())
+
+        def hash_in_order(digest):
+            position = 0
+            while position < total and not stop.is_set():
+                available = next((end for start, end in written() if start <= position < end), position)
+                if available == position:
+                    time.sleep(0.05)
+                    continue
+                self.hash_file(filename, digest, position, available)
+                position = available
+            return position == total
+
+        def fetch(i, progress):
+            start, end = ranges[i]
+            attempts = 0
+            buffer = memoryview(bytearray(self.max_chunk_size))
+            with open(filename, 'r+b', buffering=0) as file:
+                while offsets[i] < end:
+                    try:
+                        range_headers = {**headers, 'Range': f'bytes={offsets[i]}-{end - 1}'}
+                        with self.pool.slot(url), \
+                                self.pool.session.get(url, headers=range_headers, stream=True, timeout=30) as response:
+                            if response.status_code == 200 and validator:
+                                raise ValueError(f"{url} changed since the download started, run it again to restart")
+                            if response.status_code != 206:
+                                raise ValueError(f"server ignored the range request, status {response.status_code}")
+                            for data in self.read_chunks(response, buffer):
+                                if self.cancel_token.is_canceled() or stop.is_set():
+                                    return False
+                                data = data[:end - offsets[i]]
+                                self.write_at(file, data, offsets[i])
+                                with lock:
+                                    offsets[i] += len(data)
+                                progress.update(len(data))
+                        if offsets[i] < end:
+                            raise requests.ConnectionError(f"connection closed at byte {offsets[i]} of range {start}-{end}")
+                    except requests.RequestException:
+                        attempts += 1
+                        if attempts >= self.retries:
+                            raise
+                        time.sleep(attempts)
+            return True
+
+        initial = sum(end - start for start, end in self.merge_ranges(completed))
+        digest = self.new_hash() if self.hash_type else None
+        with self.progress_bar(filename, total, initial) as pbar:
+            progress = DownloadProgress(pbar, self.progress_interval)
+            executor = ThreadPoolExecutor(max_workers=len(ranges) + 1)
+            try:
+                futures = [executor.submit(fetch, i, progress) for i in range(len(ranges))]
+                hashed = executor.submit(hash_in_order, digest) if digest else None
+                pending = futures
+                while pending:
+                    done, pending = wait(pending, timeout=2, return_when=FIRST_EXCEPTION)
+                    if any(future.exception() for future in done):
+                        stop.set()
+                        break
+                    checkpoint()
+                results = [future.result() for future in futures]
+                if hashed and all(results) and not hashed.result():
+                    digest = None
+            finally:
+                stop.set()
+                executor.shutdown(wait=True)
+                checkpoint()
+                progress.flush()
+
+        return all(results), digest
+
+    def download_torrent(self):
+        engine = TorrentEngine()
+        info_hash = engine.add(self.download_link, self.download_path)
+        return engine.wait(info_hash, self.cancel_token)
 
     def cancel(self):
-        self.canceled = True
+        self.cancel_token.cancel()
+
+
+class DownloadManager:
+    """Downloads many links at once, every download shares the HttpPool session and its per host limits"""
+
+    def __init__(self, download_path="assets/media", max_downloads=None, connections=None):
+        """
+        :max_downloads: int: links downloaded at the same time, defaults to config.downloader['max_downloads']
+        :connections: int: range requests per download, see Downloader
+        """
+        self.utils = Utils()
+        self.download_path = download_path
+        self.max_downloads = max_downloads or config.downloader['max_downloads']
+        self.connections = connections
+        self.jobs = []
+        self.results = []
+
+    def add(self, download_link, checksum=None, hash_type=None, cancel_token=None):
+        """Queues a link
+
+        :cancel_token: CancelToken: cancels this download (or every one it's given to) even while it runs
+        """
+        self.jobs.append(Downloader(download_link, self.download_path, self.connections, checksum, hash_type,
+                                    cancel_token))
+        return self
+
+    def cancel(self, download_link=None):
+        """Cancels the downloads of download_link, or all of them"""
+        for downloader in self.jobs:
+            if download_link is None or download_link in (downloader.link, downloader.download_link):
+                downloader.cancel()
+
+    @staticmethod
+    def run_download(downloader):
+        started = time.time()
+        result = {"link": downloader.link, "files": None, "error": None}
+        try:
+            result["files"] = downloader.download()
+            if result["files"] is None:
+                result["error"] = "canceled"
+        except Exception as error:
+            result["error"] = str(error)
+        result["elapsed"] = time.time() - started
+        result["digest"] = downloader.digest
+        return result
 
-    def list_files_in_directory(self):
-        file_list = []
+    def run(self):
+        """Downloads the queued links, returns a result dict (link, files, error, elapsed, digest) per link"""
+        if len(self.jobs) == 0:
+            raise ValueError("no download to run, use add first")
 
-        for file in os.listdir(self.download_path):
-            path = os.path.join(self.download_path, file)
-            file_list.append(os.path.basename(path))
-        return file_list
+        self.results = []
+        with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
+            futures = [executor.submit(self.run_download, downloader) for downloader in self.jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                self.results.append(result)
+                if result["error"]:
+                    print(f"{self.utils.get_now()} failed {result['link']}: {result['error']}")
+        self.jobs = []
+        return self.results
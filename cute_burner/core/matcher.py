@@ -0,0 +1,80 @@
+import re
+
+
+class WordMatcher:
+    """Matches a text against a whole blacklist with one precompiled regex
+
+    the words are folded into a trie shaped pattern (e.g. ".com", ".co", "www" -> (?:\\.co(?:m)?|www))
+    so every position of the text is checked against shared prefixes once, not against every word.
+    build it once and reuse it for every subtitle of a run.
+    """
+
+    def __init__(self, words, ignore_case=False, whole_word=False):
+        self.ignore_case = ignore_case
+        self.whole_word = whole_word
+        self.rules = {}
+        for word in words:
+            if word:
+                self.rules.setdefault(word.lower() if ignore_case else word, word)
+
+        self.regex = None
+        if self.rules:
+            if whole_word:
+                pattern = self.whole_word_pattern(self.rules.keys())
+            else:
+                pattern = self.trie_pattern(self.rules.keys())
+            self.regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+    @classmethod
+    def whole_word_pattern(cls, words):
+        """One trie per kind of word edge, a boundary is only checked on a side where the word has a word character
+
+        e.g: ".com" matches in "site.com" but "com" doesn't match in "compare"
+        """
+        groups = {}
+        for word in words:
+            edges = (re.match(r"\w", word[0]) is not None, re.match(r"\w", word[-1]) is not None)
+            groups.setdefault(edges, []).append(word)
+        patterns = []
+        for (starts_with_word, ends_with_word), group in sorted(groups.items()):
+            pattern = cls.trie_pattern(group)
+            if starts_with_word:
+                pattern = rf"(?<!\w){pattern}"
+            if ends_with_word:
+                pattern = rf"{pattern}(?!\w)"
+            patterns.append(pattern)
+        return "|".join(patterns)
+
+    @classmethod
+    def trie_pattern(cls, words):
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        return cls.node_pattern(trie)
+
+    @classmethod
+    def node_pattern(cls, node):
+        branches = [re.escape(char) + cls.node_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = f"(?:{'|'.join(branches)})"
+        if "" in node:
+            pattern += "?"
+        return pattern
+
+    def match(self, text):
+        """Returns the blacklisted word found in text, None if it's clean"""
+        if self.regex is None:
+            return None
+        found = self.regex.search(text)
+        if found is None:
+            return None
+        matched = found.group(0)
+        rule = self.rules.get(matched.lower() if self.ignore_case else matched)
+        if rule is None:
+            # re.IGNORECASE folds some characters (e.g: "ſ" matches "s") that lower() doesn't
+            rule = next(word for key, word in self.rules.items() if re.fullmatch(re.escape(key), matched, re.IGNORECASE))
+        return rule
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import ffmpeg
+from core import config
+
+
+class ProbeCache:
+    """Persistent ffprobe cache keyed by path + size + mtime (and optionally a content hash)
+
+    entries live in a sqlite file and the least recently used ones are evicted past max_entries.
+    """
+    _instance = None
+    hash_chunk_size = 1024 * 1024
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.connection = None
+            cls._instance.path = None
+            cls._instance.hits = 0
+            cls._instance.misses = 0
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self, path=None, max_entries=None, content_hash=None):
+        if self.path is None:
+            self.path = config.probe_cache['path']
+            self.max_entries = config.probe_cache['max_entries']
+            self.content_hash = config.probe_cache['content_hash']
+        if path and path != self.path:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.path = path
+        if max_entries:
+            self.max_entries = max_entries
+        if content_hash is not None:
+            self.content_hash = content_hash
+
+    def connect(self):
+        if self.connection is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "key TEXT PRIMARY KEY, path TEXT, data TEXT, last_used REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)")
+            self.connection.commit()
+        return self.connection
+
+    def fingerprint(self, media_path):
+        """sha256 over the first and last chunk of the file, cheap enough for multi-GB media"""
+        size = os.path.getsize(media_path)
+        digest = hashlib.sha256(str(size).encode())
+        with open(media_path, 'rb') as file:
+            digest.update(file.read(self.hash_chunk_size))
+            if size > self.hash_chunk_size * 2:
+                file.seek(-self.hash_chunk_size, os.SEEK_END)
+                digest.update(file.read(self.hash_chunk_size))
+        return digest.hexdigest()
+
+    def key(self, media_path):
+        path = os.path.abspath(media_path)
+        stat = os.stat(path)
+        key = f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+        if self.content_hash:
+            key += f"|{self.fingerprint(path)}"
+        return key
+
+    def cached(self, key, media_path, compute):
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT data FROM probes WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.hits += 1
+                connection.execute("UPDATE probes SET last_used = ? WHERE key = ?", (time.time(), key))
+                connection.commit()
+                return json.loads(row[0])
+
+        data = compute()
+
+        with self.lock:
+            self.misses += 1
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO probes (key, path, data, last_used) VALUES (?, ?, ?, ?)",
+                (key, os.path.abspath(media_path), json.dumps(data), time.time())
+            )
+            self.evict(connection)
+            connection.commit()
+
+        return data
+
+    def probe(self, media_path, **kwargs):
+        """Same as ffmpeg.probe but served from the cache when the file didn't change"""
+        key = self.key(media_path)
+        if kwargs:
+            key += "|" + json.dumps(kwargs, sort_keys=True)
+        return self.cached(key, media_path, lambda: ffmpeg.probe(media_path, **kwargs))
+
+    def keyframes(self, media_path):
+        """Sorted timestamps (seconds) of the keyframes of the first video stream a cut can start at, read from packets
+
+        keyframes of open GOPs (a later packet is shown before them, e.g. hevc CRA with leading pictures) are left out.
+        """
+
+        def compute():
+            packets = ffmpeg.probe(media_path, select_streams="v:0", show_entries="packet=pts_time,flags")["packets"]
+            keyframes = []
+            for packet in packets:
+                if packet.get("pts_time", "N/A") == "N/A":
+                    continue
+                pts = float(packet["pts_time"])
+                if "K" in packet.get("flags", ""):
+                    keyframes.append(pts)
+                elif keyframes and keyframes[-1] is not None and pts < keyframes[-1]:
+                    keyframes[-1] = None
+            return sorted(keyframe for keyframe in keyframes if keyframe is not None)
+
+        return self.cached(self.key(media_path) + "|closed_keyframes", media_path, compute)
+
+    def evict(self, connection):
+        count = connection.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        if count > self.max_entries:
+            connection.execute(
+                "DELETE FROM probes WHERE key IN (SELECT key FROM probes ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def invalidate(self, media_path):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM probes WHERE path = ?", (os.path.abspath(media_path),))
+            connection.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0}
@@ -0,0 +1,134 @@
+import json
+import time
+import subprocess
+import tqdm
+
+
+class ProgressBar:
+    """tqdm sink, shows processed seconds and estimated finish time"""
+
+    def __init__(self, media_duration, media_output_path):
+        self.media_duration = media_duration
+        self.media_output_path = media_output_path
+        self.progress_bar = tqdm.tqdm(total=media_duration, initial=0, unit="s",
+                                      desc=f"Processing {media_output_path}",
+                                      ascii=True,
+                                      bar_format='{desc} {percentage:3.0f}% | {n:.2f}s/{total:.2f}s |{rate_fmt}{postfix}')
+
+    def update(self, event):
+        if event["out_time"] is not None:
+            self.progress_bar.n = min(max(event["out_time"], 0), self.media_duration)
+            if event["speed"]:
+                remaining_time = max(self.media_duration - event["out_time"], 0) / event["speed"]
+                estimated_finish_time = time.strftime("%H:%M:%S", time.gmtime(remaining_time))
+                self.progress_bar.set_description(
+                    f"Processing {self.media_output_path} (Est Finish {estimated_finish_time})", refresh=False
+                )
+        self.progress_bar.refresh()
+
+    def close(self):
+        self.progress_bar.close()
+
+
+class ProgressCallback:
+    """Calls callback(event) for every progress update"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, event):
+        self.callback(event)
+
+    def close(self):
+        pass
+
+
+class ProgressJson:
+    """Appends every progress update as a json line to path"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def update(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Progress:
+    """Streams ffmpeg's `-progress pipe:1` output and forwards structured events to sinks
+
+    every key=value block ffmpeg writes is parsed once into a dict of
+    frame, fps, bitrate, total_size, out_time_us, out_time (seconds), speed and progress.
+    """
+    int_keys = ("frame", "total_size", "out_time_us", "dup_frames", "drop_frames")
+
+    def __init__(self, sinks=None):
+        self.sinks = sinks or []
+        self.last_event = None
+
+    @classmethod
+    def parse(cls, lines):
+        """Yields one event per progress block from an iterable of key=value lines"""
+        block = {}
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='ignore')
+            key, sep, value = line.strip().partition("=")
+            if not sep:
+                continue
+            block[key] = value
+            if key == "progress":
+                yield cls.to_event(block)
+                block = {}
+
+    @classmethod
+    def to_event(cls, block):
+        event = {}
+        for key in cls.int_keys:
+            value = block.get(key, "N/A")
+            event[key] = int(value) if value.lstrip("-").isdigit() else None
+
+        fps = block.get("fps", "N/A")
+        event["fps"] = float(fps) if fps != "N/A" else None
+        bitrate = block.get("bitrate", "N/A").replace("kbits/s", "")
+        event["bitrate"] = float(bitrate) if bitrate != "N/A" else None
+        speed = block.get("speed", "N/A").replace("x", "")
+        event["speed"] = float(speed) if speed not in ("N/A", "") else None
+        event["out_time"] = event["out_time_us"] / 1000000 if event["out_time_us"] is not None else None
+        event["progress"] = block.get("progress")
+        return event
+
+    def follow(self, lines):
+        """Forwards every event parsed from lines to the sinks until ffmpeg reports the end"""
+        try:
+            for event in self.parse(lines):
+                self.last_event = event
+                for sink in self.sinks:
+                    sink.update(event)
+                if event["progress"] == "end":
+                    break
+        finally:
+            for sink in self.sinks:
+                sink.close()
+        return self.last_event
+
+    def run(self, command, quiet=False):
+        """Runs an ffmpeg-python command (or compiled argument list) whose output options include progress='pipe:1'
+
+        returns ffmpeg's exit code.
+        """
+        args = command if isinstance(command, list) else command.compile(overwrite_output=True)
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL if quiet else None,
+        )
+        self.follow(process.stdout)
+        # drain whatever is left so ffmpeg never blocks on a full pipe
+        for _ in process.stdout:
+            pass
+        return process.wait()
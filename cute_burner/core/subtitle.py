@@ -1,14 +1,28 @@
 from core.utils import Utils
+from core.ass import AssDocument
+from core.subtitle_formats import SubtitleFormats
+from core.timestamp import Timestamp
+from core.timeline import Timeline
+from core.matcher import WordMatcher
+from core.translator import Translation
+from core import config
+import numpy as np
 import ffmpeg
 import re
 import os
-from googletrans import Translator
-from deep_translator import GoogleTranslator
-from datetime import timedelta, datetime
 
 
 class Subtitle:
     _instance = None
+    # text codecs demuxed as is (-c:s copy) and converted in-process, others are converted by ffmpeg
+    copy_codecs = {"ass": "ass", "ssa": "ass", "subrip": "srt", "webvtt": "webvtt"}
+    # codec: (extension, subtitle codec) of extract_subtitles, text codecs without a file format of their own become SRT
+    extract_formats = {
+        "ass": ("ass", "copy"), "ssa": ("ass", "copy"), "subrip": ("srt", "copy"), "webvtt": ("vtt", "copy"),
+        "hdmv_pgs_subtitle": ("sup", "copy"), "dvd_subtitle": ("mks", "copy"), "dvb_subtitle": ("mks", "copy"),
+    }
+    bitmap_codecs = ("hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle", "xsub")
+    drawing_regex = re.compile(r'{[^}]*\bm\s+\d')
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -27,15 +41,21 @@ class Subtitle:
         self.utils.validate_file(self.font_path)
         self.media_duration = None
         self.dialogues = None
+        self.document = None
+        self.removed_lines = []
+        self.video_info = None
 
-        if self.utils.get_file_extension(media_path) == "mkv":
+        if os.path.splitext(media_path)[1].lower() in config.video_extensions:
             self.video_stream, self.audio_stream, self.subtitle_streams, self.media_duration, self.video_info = self.utils.media_streams(
                 self.media_path)
         elif video_info:
             self.video_stream, self.audio_stream, self.subtitle_streams, self.media_duration, self.video_info = video_info
 
     def extract_subtitle(self, index=0):
-        """Extracts embedded first subtitle from media"""
+        """Extracts embedded first subtitle from media
+
+        ASS tracks are copied as they are, SRT and WebVTT tracks are demuxed without decoding and converted in-process.
+        """
         if not self.video_info:
             raise ValueError("you need to provide video info in order to use extract_subtitle method")
         subtitle_streams = [stream for stream in self.video_info['streams'] if stream['codec_type'] == 'subtitle']
@@ -43,105 +63,202 @@ class Subtitle:
         if len(subtitle_streams) == 0:
             raise ValueError("no subtitle found to extract")
 
+        stream = subtitle_streams[index]
         sub_output = self.utils.append_random_name(f"{self.base_path}/extracted_sub.ass")
+        muxer = self.copy_codecs.get(stream.get('codec_name'))
 
         try:
-            ffmpeg.input(self.media_path, sub_charenc='utf-8').output(sub_output, map='0:{}'.format(subtitle_streams[index]['index']), scodec='ass').run(
-                overwrite_output=True, quiet=self.show_ffmpeg_log)
+            media = ffmpeg.input(self.media_path, sub_charenc='utf-8')
+            mapping = '0:{}'.format(stream['index'])
+            if muxer == "ass":
+                media.output(sub_output, map=mapping, scodec='copy').run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+            elif muxer:
+                output, _ = media.output('pipe:', map=mapping, scodec='copy', format=muxer).run(
+                    capture_stdout=True, quiet=self.show_ffmpeg_log)
+                text = output.decode('utf-8-sig', errors='replace')
+                SubtitleFormats.parse(text, "vtt" if muxer == "webvtt" else "srt").save(sub_output)
+            else:
+                media.output(sub_output, map=mapping, scodec='ass').run(overwrite_output=True, quiet=self.show_ffmpeg_log)
             self.media_path = sub_output
+            self.document = None
         except ffmpeg.Error as e:
             raise ValueError(e)
 
         return self
 
-    def remove_words(self, words_to_remove_from_subtitle):
-        if not self.media_duration:
-            raise ValueError("you need to provide video info in order to use remove_words method")
+    def extract_subtitles(self, languages=None, codecs=None, titles=None, include_bitmap=False, output_path=None):
+        """Extracts every selected subtitle track of the media in one ffmpeg run, returns the manifest of the files
+
+        :languages: list: language tags to keep e.g: ["eng", "per"], every language by default
+        :codecs: list: codec names to keep e.g: ["ass", "subrip"]
+        :titles: list: keeps tracks whose title contains one of these (case-insensitive) e.g: ["forced"]
+        :include_bitmap: bool: PGS/VobSub/DVB tracks are skipped unless set
+        :output_path: str: folder of the extracted files, defaults to base_path
 
-        for i_loop in range(40):
-            self.extract_dialogues()
-            with open(self.media_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            dialogue_index = 0
-            new_lines = []
-            for i, line in enumerate(lines):
-                line = self.utils.arabic_to_persian(line)
-                add_line = True
-                if line.startswith("Dialogue:"):
-                    match = re.compile(r"Dialogue: \d+,(\d+:\d+:\d+\.\d+),(\d+:\d+:\d+\.\d+),").search(line)
-                    current_start_time = self.utils.parse_time(match.group(1)).time()
-                    current_start_seconds = current_start_time.hour * 3600 + current_start_time.minute * 60 + current_start_time.second
-                    current_end = self.utils.parse_time(match.group(2))
-                    current_end_time = current_end.time()
-                    current_end_seconds = current_end_time.hour * 3600 + current_end_time.minute * 60 + current_end_time.second
-
-                    if dialogue_index > 20:
-                        prev_end = self.dialogues[dialogue_index - 1]['timing'][1]
-                        prev_end_time = self.dialogues[dialogue_index - 1]['timing'][1].time()
-                        prev_end_seconds = prev_end_time.hour * 3600 + prev_end_time.minute * 60 + prev_end_time.second
-                        dialogue_index += 1
-                        if timedelta(seconds=current_start_seconds) < timedelta(seconds=prev_end_seconds) and prev_end != current_end:
-                            continue
-                        elif current_start_seconds > self.media_duration or current_end_seconds > self.media_duration:
-                            continue
-                    elif dialogue_index < 3:
-                        next_end = self.dialogues[dialogue_index + 1]['timing'][1]
-                        next_end_time = self.dialogues[dialogue_index + 1]['timing'][1].time()
-                        next_end_seconds = next_end_time.hour * 3600 + next_end_time.minute * 60 + next_end_time.second
-                        dialogue_index += 1
-                        if timedelta(seconds=current_start_seconds) > timedelta(seconds=next_end_seconds) and next_end != current_end:
-                            continue
-                    else:
-                        dialogue_index += 1
-
-                    if current_start_seconds > self.media_duration or current_end_seconds > self.media_duration:
-                        continue
-
-                for index, word in enumerate(words_to_remove_from_subtitle):
-                    if word in rf"{line}":
-                        add_line = False
-                        break
-
-                if bool(re.compile(r'{[^}]*\bm\s+\d').search(line)):
-                    continue
-
-                if add_line:
-                    new_lines.append(line)
-
-            with open(self.media_path, 'w', encoding='utf-8') as main_file:
-                main_file.writelines(new_lines)
+        ASS, SRT and WebVTT tracks keep their codec (-c:s copy), other text tracks are converted to SRT.
+        files are named <media>.<stream index>.<language>.<ext>, every manifest entry has the stream index, codec,
+        language, title, default and forced flags and path of the file.
+        """
+        if not self.video_info:
+            raise ValueError("you need to provide video info in order to use extract_subtitles method")
+        output_path = output_path or self.base_path
+        self.utils.check_folder(output_path)
+        languages = [language.lower() for language in languages] if languages else None
+        titles = [title.lower() for title in titles] if titles else None
+        name = os.path.basename(self.utils.remove_file_extension(self.media_path))
+
+        manifest = []
+        for stream in self.video_info['streams']:
+            if stream['codec_type'] != 'subtitle':
+                continue
+            codec = stream.get('codec_name', '')
+            tags = {key.lower(): value for key, value in stream.get('tags', {}).items()}
+            language = tags.get('language', 'und').lower()
+            title = tags.get('title', '')
+            if (codec in self.bitmap_codecs and not include_bitmap) or (codecs and codec not in codecs):
+                continue
+            if (languages and language not in languages) or (titles and not any(word in title.lower() for word in titles)):
+                continue
+            if codec in self.bitmap_codecs and codec not in self.extract_formats:
+                continue
+
+            extension, subtitle_codec = self.extract_formats.get(codec, ("srt", "srt"))
+            disposition = stream.get('disposition', {})
+            manifest.append({
+                "index": stream['index'],
+                "codec": codec,
+                "language": language,
+                "title": title,
+                "default": bool(disposition.get('default')),
+                "forced": bool(disposition.get('forced')),
+                "path": f"{output_path}/{name}.{stream['index']}.{language}.{extension}",
+                "subtitle_codec": subtitle_codec,
+            })
+
+        if len(manifest) == 0:
+            raise ValueError("no subtitle found to extract")
+
+        media = ffmpeg.input(self.media_path)
+        outputs = [
+            media.output(entry["path"], map='0:{}'.format(entry["index"]), scodec=entry.pop("subtitle_codec"))
+            for entry in manifest
+        ]
+        try:
+            ffmpeg.merge_outputs(*outputs).run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+        except ffmpeg.Error as e:
+            raise ValueError(e)
 
+        return manifest
+
+    def load(self):
+        """Parses the subtitle once, following operations share the in-memory document"""
+        if self.document is None or self.document.path != self.media_path:
+            self.utils.validate_file(self.media_path)
+            self.document = SubtitleFormats.read(self.media_path)
+        return self.document
+
+    def save(self):
+        """Writes pending changes of the in-memory document to disk, in the format of the subtitle file"""
+        if self.document is not None and self.document.dirty:
+            SubtitleFormats.write(self.document, self.media_path)
+            self.document.path = self.media_path
+            self.document.dirty = False
         return self
 
-    def extract_dialogues(self, prev_dialogue=1, next_dialogue=1):
-        self.utils.validate_file(self.media_path)
+    def remove_words(self, words_to_remove_from_subtitle, ignore_case=False, whole_word=False):
+        """Removes dialogues containing blacklisted words, drawings, overlapping and out of duration dialogues
 
-        dialogues = []
+        :words_to_remove_from_subtitle: list or WordMatcher: blacklist, pass a WordMatcher to reuse it across subtitles
+        :ignore_case: bool: case-insensitive matching when a list is given
+        :whole_word: bool: match whole words only when a list is given
+
+        every removed line is kept in self.removed_lines with the rule that removed it.
+        """
+        if not self.media_duration:
+            raise ValueError("you need to provide video info in order to use remove_words method")
 
-        with open(self.media_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
+        if isinstance(words_to_remove_from_subtitle, WordMatcher):
+            matcher = words_to_remove_from_subtitle
+        else:
+            matcher = WordMatcher(words_to_remove_from_subtitle, ignore_case=ignore_case, whole_word=whole_word)
+
+        document = self.load()
+        indexes = document.event_indexes()
+        out_of_duration = Timeline.from_events(document.events).out_of_duration(Timestamp.from_seconds(self.media_duration))
+
+        # blacklisted words, drawings and out of duration timings don't depend on neighbours,
+        # decide them once instead of on every pass
+        rejected = {}
+        lines = {}
+        for i, event in enumerate(document.events):
+            event.text = self.utils.arabic_to_persian(event.text)
+            line = document.event_line(event, indexes)
+            lines[id(event)] = line
+            if event.kind == "Dialogue" and out_of_duration[i]:
+                rejected[id(event)] = "out_of_duration"
+                continue
+            rule = matcher.match(line)
+            if rule is not None:
+                rejected[id(event)] = rule
+            elif self.drawing_regex.search(line):
+                rejected[id(event)] = "drawing"
+
+        events = document.events
+        document.events = self.filter_events(events, rejected)
+
+        kept = set(id(event) for event in document.events)
+        self.removed_lines = [
+            {"line": lines[id(event)], "rule": rejected.get(id(event), "overlap")}
+            for event in events if id(event) not in kept
+        ]
 
-        format_line = self.utils.get_dialogue_format(lines)
-        text_index = self.utils.get_text_field_index(format_line)
+        document.dirty = True
+        self.extract_dialogues()
 
-        regex_pattern = r"Dialogue: " + r"(?:[^,]*,)" * text_index + r"(.*)"
+        return self
 
-        dialogue_index = 0
-        for i, line in enumerate(lines):
-            if line.startswith("Dialogue:"):
-                match = re.search(regex_pattern, line)
-                if match:
-                    en_dialogue = match.group(1).strip()
-                    en_dialogue = en_dialogue.replace("\\N", " ")
+    @staticmethod
+    def filter_events(events, rejected, max_passes=40):
+        """Drops rejected and overlapping dialogues until nothing changes (at most max_passes)
+
+        every pass compares a dialogue with its neighbours from the previous pass:
+        after the 21st dialogue it's dropped when it starts before the previous one ends,
+        among the first 3 when it starts after the next one ends (timings in whole seconds).
+        a pass is a few array operations over the positions of the events still kept.
+        """
+        timeline = Timeline.from_events(events)
+        is_dialogue = np.fromiter((event.kind == "Dialogue" for event in events), dtype=bool, count=len(events))
+        accepted = np.fromiter((id(event) not in rejected for event in events), dtype=bool, count=len(events))
+        alive = np.arange(len(events))
+
+        for i_loop in range(max_passes):
+            dialogues = alive[is_dialogue[alive]]
+            starts = timeline.starts[dialogues] // 100
+            ends = timeline.ends[dialogues]
+
+            dropped = np.zeros(len(dialogues), dtype=bool)
+            dropped[21:] = (starts[21:] < ends[20:-1] // 100) & (ends[20:-1] != ends[21:])
+            first = min(3, len(dialogues) - 1)
+            if first > 0:
+                dropped[:first] = (starts[:first] > ends[1:first + 1] // 100) & (ends[1:first + 1] != ends[:first])
+
+            keep = accepted.copy()
+            keep[dialogues[dropped]] = False
+            kept = alive[keep[alive]]
+            if len(kept) == len(alive):
+                break
+            alive = kept
+
+        return [events[i] for i in alive]
 
-                    match2 = re.compile(r"Dialogue: \d+,(\d+:\d+:\d+\.\d+),(\d+:\d+:\d+\.\d+),").search(line)
-                    current_start = self.utils.parse_time(match2.group(1))
-                    current_end = self.utils.parse_time(match2.group(2))
+    def extract_dialogues(self, prev_dialogue=1, next_dialogue=1):
+        document = self.load()
 
-                    timing = [current_start, current_end]
-                    dialogues.append({"en": en_dialogue, "timing": timing, "prev_dialogues": [], "next_dialogues": [], "fa": "", "fa_edited": ""})
-                    dialogue_index += 1
+        dialogues = []
+        for event in document.events:
+            if event.kind == "Dialogue":
+                en_dialogue = event.text.strip().replace("\\N", " ")
+                dialogues.append({"en": en_dialogue, "timing": [event.start, event.end], "prev_dialogues": [], "next_dialogues": [], "fa": "", "fa_edited": ""})
 
         for i, dialogue in enumerate(dialogues):
             dialogue["prev_dialogues"] = [dialogues[i - (pi + 1)]['en'] for pi in range(prev_dialogue) if i - (pi + 1) >= 0]
@@ -151,57 +268,22 @@ class Subtitle:
 
         return dialogues
 
-    def translate_subtitle(self):
-        self.utils.validate_file(self.media_path)
+    def translate_subtitle(self, backend=None, **kwargs):
+        """Translates every dialogue with its previous and next dialogue as context
+
+        :backend: TranslatorBackend: defaults to GoogleBackend
+        :kwargs: forwarded to Translation e.g: source, target, batch_size, max_workers, requests_per_second
+        """
+        document = self.load()
+        self.extract_dialogues()
 
-        if not self.dialogues:
-            self.extract_dialogues()
-
-        # proxies = {
-        #     'http': 'http://your_proxy_ip:your_proxy_port',
-        #     'https': 'https://your_proxy_ip:your_proxy_port'
-        # }
-        # translator = Translator(proxies=proxies)
-        translator = Translator()
-
-        with open(self.media_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-
-        format_line = self.utils.get_dialogue_format(lines)
-        text_index = self.utils.get_text_field_index(format_line)
-
-        regex_pattern = r"Dialogue: " + r"(?:[^,]*,)" * text_index + r"(.*)"
-
-        new_lines = []
-
-        dialogue_index = 0
-        for i, line in enumerate(lines):
-            if line.startswith("Dialogue:"):
-                match = re.search(regex_pattern, line)
-                if match:
-                    try:
-                        en_dialogue = self.utils.concat_dialogue(self.dialogues[dialogue_index])
-                        fa_dialogue = translator.translate(en_dialogue, src='en', dest='fa').text
-                        fa_dialogue = fa_dialogue.replace("\\", r"\\")
-                        fa_dialogue = re.findall(r'\[~](.*?)\[~]', fa_dialogue)[0]
-                        fa_dialogue = self.utils.handle_long_dialogue(fa_dialogue)
-                    except Exception as e:
-                        try:
-                            en_dialogue = self.utils.concat_dialogue(self.dialogues[dialogue_index])
-                            fa_dialogue = GoogleTranslator(source='en', target='fa').translate(en_dialogue)
-                            fa_dialogue = fa_dialogue.replace("\\", r"\\")
-                            fa_dialogue = re.findall(r'\[~](.*?)\[~]', fa_dialogue)[0]
-                            fa_dialogue = self.utils.handle_long_dialogue(fa_dialogue)
-                        except Exception as e:
-                            fa_dialogue = "بدون ترجمه"
-                    line = re.sub(rf"(Dialogue: (?:[^,]*,){{{text_index}}}).*", r"\1" + fa_dialogue, line)
-                    line = line.replace("~", r"\N")
-                    dialogue_index += 1
-                print(f"{dialogue_index}/{len(self.dialogues)}")
-            new_lines.append(line)
-
-        with open(self.media_path, 'w', encoding='utf-8') as main_file:
-            main_file.writelines(new_lines)
+        translated = Translation(backend, **kwargs).translate(self.dialogues)
+
+        dialogue_events = [event for event in document.events if event.kind == "Dialogue"]
+        for event, fa_dialogue in zip(dialogue_events, translated):
+            event.text = self.utils.handle_long_dialogue(fa_dialogue).replace("~", r"\N")
+
+        document.dirty = True
 
         return self
 
@@ -210,92 +292,79 @@ class Subtitle:
             raise ValueError("you need to provide video info in order to use customize_subtitle method")
         self.utils.check_folder(self.media_path)
 
-        if not self.dialogues:
-            self.extract_dialogues()
-
-        gap_seconds = 20
-        gaps = []
-        for i, dialogue in enumerate(self.dialogues):
-            dialogue = dialogue['timing']
-            previous_end = self.dialogues[i - 1]['timing'][1]
-            current_start = dialogue[0]
-            current_end = dialogue[1]
-            current_end_time = dialogue[1].time()
-            current_end_seconds = current_end_time.hour * 3600 + current_end_time.minute * 60 + current_end_time.second
-            dialogue_gap = current_start - previous_end
-            intro_time = datetime.strptime('0:00:10', '%H:%M:%S')
-
-            if i + 1 == len(self.dialogues) and self.media_duration > current_end_seconds and timedelta(
-                    seconds=self.media_duration - current_end_seconds) > timedelta(seconds=gap_seconds):
-                end = (current_end + timedelta(seconds=self.media_duration - current_end_seconds))
-
-                gaps.append(
-                    {"start": f"{current_end.hour}:{current_end.minute:02}:{current_end.second:02}",
-                     "end": f"{end.hour}:{end.minute:02}:{end.second:02}"})
-            elif dialogue_gap > timedelta(seconds=gap_seconds) and current_start > intro_time:
-                gaps.append(
-                    {"start": f"{previous_end.hour}:{previous_end.minute:02}:{previous_end.second:02}",
-                     "end": f"{current_start.hour}:{current_start.minute:02}:{current_start.second:02}"})
-
-        append = [
-            r"Dialogue: 0,0:00:00.00,0:00:10.00,Default,,0,0,0,,{\fad(3000,3000)\an8\fs50\c&H26D9D9&\3c&H000000&}" + intro
-        ]
+        document = self.load()
 
-        for i, gap in enumerate(gaps):
-            start = gap['start']
-            end = gap['end']
+        # timings are centiseconds, gaps are rounded down to whole seconds
+        gap_length = 20 * 100
+        intro_time = 10 * 100
+        dialogues = [event for event in document.events if event.kind == "Dialogue"]
+        timeline = Timeline.from_events(dialogues, Timestamp.from_seconds(self.media_duration))
+        gaps = [(start // 100 * 100, end // 100 * 100) for start, end in timeline.gaps(gap_length, after=intro_time).tolist()]
 
+        fade = r"{\fad(3000,3000)\an8\fs50\c&H26D9D9&\1a&H00&}"
+        document.events.append(document.new_event(0, intro_time, r"{\fad(3000,3000)\an8\fs50\c&H26D9D9&\3c&H000000&}" + intro))
+        for i, (start, end) in enumerate(gaps):
             if i == 0:
-                append.append(
-                    f"Dialogue: 0,{start}.00,{end}.00" + r",Default,,0,0,0,,{\fad(3000,3000)\an8\fs50\c&H26D9D9&\1a&H00&}" + opening)
+                document.events.append(document.new_event(start, end, fade + opening))
             elif i + 1 == len(gaps):
-                append.append(
-                    f"Dialogue: 0,{start}.00,{end}.00" + r",Default,,0,0,0,,{\fad(3000,3000)\an8\fs50\c&H26D9D9&\1a&H00&}" + ending)
-
-        data = {
-            "player_res": [
-                "PlayResX: 1920",
-                "PlayResY: 1080",
-                "ScaledBorderAndShadow: yes"
-            ],
-            "script_info": [
-                f"; Script Copy Right: {sub_copyright}",
-            ],
-            "font": [self.font_path],
-            "append": append
-        }
-        self.utils.write_line_into_file(self.media_path, data)
+                document.events.append(document.new_event(start, end, fade + ending))
+
+        document.section("Script Info").lines.insert(0, f"; Script Copy Right: {sub_copyright}")
+        document.set_info("PlayResX", "1920")
+        document.set_info("PlayResY", "1080")
+        document.set_info("ScaledBorderAndShadow", "yes")
+
+        font_name = os.path.basename(self.utils.remove_file_extension(self.font_path))
+        styles_section = next((section.name for section in document.sections if section.name in document.styles_sections), "V4+ Styles")
+        document.section(styles_section, before=document.events_section)
+        document.styles_format = document.split_format(
+            "Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding"
+        )
+        document.styles = [
+            document.parse_style(f"Default,{font_name},70,&H26D9D9&,&H000000FF,&H00000000,&H00000000,-1,0,0,0,100,100,0,0,1,2.50001,0,2,20,20,30,1")
+        ]
+        document.section("Fonts", before=document.events_section).lines = [f"fontname: {font_name}"]
+        document.dirty = True
 
         return self
 
-    def time_shift(self, shift_seconds: float = 5.0):
+    def time_shift(self, shift_seconds: float = 5.0, ranges=None, source_fps=None, target_fps=None):
         """
         Shifts time for subtitles by a specified number of seconds.
 
         Parameters:
         shift_seconds (float): Number of seconds to shift the subtitles. Positive for forward, negative for backward.
+        ranges (list): (from_seconds, shift_seconds) pairs, dialogues starting at or after from_seconds take that shift instead
+            e.g: [(600, 1.5), (1200, 0.8)] for a subtitle drifting after an ad break
+        source_fps, target_fps (float): fixes drift of a subtitle timed on source_fps played on target_fps (e.g: 23.976 to 25),
+            times are scaled before shifting
+
+        an ASS subtitle that isn't loaded yet is streamed line by line to a temp file renamed over it, whatever its size.
         """
-        with open(self.media_path, 'r+', encoding='utf-8') as file:
-            lines = file.readlines()
-            file.seek(0)
-            file.truncate()
-
-            # Regex to match dialogue lines with timestamps
-            dialogue_regex = re.compile(r"Dialogue: \d+,(\d:\d\d:\d\d\.\d+),(\d:\d\d:\d\d\.\d+),")
-
-            for line in lines:
-                match = dialogue_regex.match(line)
-                if match:
-                    start_time, end_time = match.group(1), match.group(2)
-                    new_start_time = self.utils.shift_time(start_time, shift_seconds)
-                    new_end_time = self.utils.shift_time(end_time, shift_seconds)
-                    line = line.replace(start_time, new_start_time, 1).replace(end_time, new_end_time, 1)
-                file.write(line)
+        scale = source_fps / target_fps if source_fps and target_fps else 1.0
+        transform = Timestamp.retime(
+            Timestamp.from_seconds(shift_seconds),
+            [(Timestamp.from_seconds(start), Timestamp.from_seconds(shift)) for start, shift in ranges or []],
+            scale
+        )
+
+        unloaded = self.document is None or self.document.path != self.media_path
+        if unloaded and SubtitleFormats.format_of(self.media_path) == "ass":
+            self.utils.validate_file(self.media_path)
+            AssDocument.rewrite(self.media_path, transform)
+            self.document = None
+            return self
+
+        document = self.load()
+        for event in document.events:
+            transform(event)
+        document.dirty = True
 
         return self
 
     def change_title(self, title):
         """Changes subtitle name"""
+        self.save()
         title = self.utils.check_extension(title, "ass")
         path = f"{self.base_path}/{title}"
         if os.path.exists(path):
@@ -304,16 +373,17 @@ class Subtitle:
             os.rename(new_path, path)
         else:
             os.rename(self.media_path, path)
+            self.media_path = path
+            if self.document is not None:
+                self.document.path = path
 
         return self
 
     def convert_srt_to_ass(self, i, leading_zero):
-        (
-            ffmpeg
-            .input(self.media_path)
-            .output(f"{self.base_path}/{self.utils.append_leading_zero(leading_zero, i + 1)}.ass", format='ass')
-            .run(overwrite_output=True)
-        )
+        """Writes the subtitle as <i + 1 with leading zeros>.ass next to it, converted in-process"""
+        self.save()
+        return SubtitleFormats.convert(self.media_path, f"{self.base_path}/{self.utils.append_leading_zero(leading_zero, i + 1)}.ass")
 
     def return_path(self):
+        self.save()
         return self.media_path
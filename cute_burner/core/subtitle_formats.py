@@ -0,0 +1,202 @@
+import os
+import re
+import html
+from core.ass import AssDocument, Event, Section
+from core.timestamp import Timestamp
+
+
+class SubtitleFormats:
+    """Reads and writes SRT, WebVTT and ASS in-process, all of them on the AssDocument event model
+
+    SRT/VTT files become an AssDocument with ffmpeg's default header and Default style, their basic tags
+    (<i>, <b>, <u>, <s>, <font color>) turn into override tags and back. ffmpeg is only needed to demux
+    subtitles out of containers.
+    """
+    extensions = ("ass", "ssa", "srt", "vtt")
+    script_info = ["ScriptType: v4.00+", "PlayResX: 384", "PlayResY: 288", "ScaledBorderAndShadow: yes", "YCbCr Matrix: None"]
+    styles_format = "Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding"
+    default_style = "Default,Arial,16,&Hffffff,&Hffffff,&H0,&H0,0,0,0,0,100,100,0,0,1,1,0,2,10,10,10,1"
+
+    simple_tags = [(f"<{slash}{tag}>", "{\\%s%d}" % (tag, 0 if slash else 1)) for tag in "ibus" for slash in ("", "/")]
+    html_tag_regex = re.compile(r'<(/?)([a-zA-Z]+)((?:[.\s][^>]*)?)>')
+    color_regex = re.compile(r'color\s*=\s*["\']?#?([0-9a-fA-F]{6})')
+    override_regex = re.compile(r'{([^}]*)}')
+    override_tag_regex = re.compile(r'\\(?:([ibus])(\d)|1?c(?:&H([0-9a-fA-F]+)&?)?|(an\d)|(p[1-9]))')
+    vtt_timestamp_regex = re.compile(r'<\d[\d:.]*>')
+    timestamp = r'(?:(\d+):)?(\d+):(\d+)(?:[,.](\d+))?'
+    timing_regex = re.compile(r'[ \t]*%s[ \t]*-->[ \t]*%s' % (timestamp, timestamp))
+
+    @classmethod
+    def format_of(cls, path):
+        extension = os.path.splitext(path)[1][1:].lower()
+        if extension not in cls.extensions:
+            raise ValueError(f"{path} is not a {', '.join(cls.extensions)} subtitle")
+        return "ass" if extension == "ssa" else extension
+
+    @classmethod
+    def new_document(cls):
+        """Empty AssDocument with the header and Default style ffmpeg writes when converting to ASS"""
+        document = AssDocument()
+        document.sections = [Section("Script Info", list(cls.script_info)), Section("V4+ Styles"), Section(document.events_section)]
+        document.styles_format = document.split_format(cls.styles_format)
+        document.styles = [document.parse_style(cls.default_style)]
+        return document
+
+    @classmethod
+    def read(cls, path):
+        """Parses an ASS, SRT or VTT file into an AssDocument"""
+        subtitle_format = cls.format_of(path)
+        if subtitle_format == "ass":
+            return AssDocument(path)
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            document = cls.parse(file.read(), subtitle_format)
+        document.path = path
+        return document
+
+    @classmethod
+    def parse(cls, text, subtitle_format):
+        """Parses the content of an ASS, SRT or VTT file"""
+        if subtitle_format == "ass":
+            document = AssDocument()
+            document.parse(text.splitlines())
+            return document
+        document = cls.new_document()
+        values = document.new_event(0, 0, "").values
+        vtt = subtitle_format == "vtt"
+        for start, end, lines in cls.cues(text, vtt):
+            dialogue = r"\N".join(lines)
+            if vtt:
+                dialogue = html.unescape(cls.vtt_timestamp_regex.sub("", dialogue))
+            if "<" in dialogue:
+                dialogue = cls.html_to_ass(dialogue)
+            document.events.append(Event("Dialogue", start, end, dialogue, list(values)))
+        return document
+
+    @classmethod
+    def cues(cls, text, vtt=False):
+        """(start, end, text lines) of every cue, a cue runs from its timing line to the next one
+
+        the identifier line before a timing line (SRT counter or VTT cue id) and blank lines are dropped,
+        so a blank line inside a cue doesn't cut it. VTT NOTE, STYLE and REGION blocks are skipped.
+        """
+        lines = text.splitlines()
+        timings = [i for i, line in enumerate(lines) if "-->" in line]
+        for position, i in enumerate(timings):
+            timing = cls.timing_regex.match(lines[i])
+            if timing is None:
+                continue
+            block = lines[i + 1:timings[position + 1] if position + 1 < len(timings) else len(lines)]
+            # the identifier of the next cue follows a blank line, an SRT counter is a number
+            if position + 1 < len(timings) and block and block[-1].strip() and (
+                    len(block) == 1 or not block[-2].strip() or (not vtt and block[-1].strip().isdigit())):
+                block.pop()
+            if vtt:
+                text_lines = []
+                for j, line in enumerate(block):
+                    if line.split(" ", 1)[0] in ("NOTE", "STYLE", "REGION") and (j == 0 or not block[j - 1].strip()):
+                        break
+                    if line.strip():
+                        text_lines.append(line)
+            else:
+                text_lines = [line for line in block if line.strip()]
+            yield Timestamp.from_parts(*timing.group(1, 2, 3, 4)), Timestamp.from_parts(*timing.group(5, 6, 7, 8)), text_lines
+
+    @classmethod
+    def html_to_ass(cls, text):
+        def replace(match):
+            closing, tag, attributes = match.group(1), match.group(2).lower(), match.group(3)
+            if tag in ("i", "b", "u", "s"):
+                return "{\\%s%d}" % (tag, 0 if closing else 1)
+            if tag == "font":
+                if closing:
+                    return "{\\c}"
+                color = cls.color_regex.search(attributes)
+                if color:
+                    rgb = color.group(1).upper()
+                    return "{\\c&H%s%s%s&}" % (rgb[4:6], rgb[2:4], rgb[0:2])
+            return ""
+
+        for tag, override in cls.simple_tags:
+            text = text.replace(tag, override)
+        return cls.html_tag_regex.sub(replace, text) if "<" in text else text
+
+    @classmethod
+    def ass_to_html(cls, text, keep_alignment=True, escape=False, keep_colors=True):
+        """Override tags to <i>, <b>, <u>, <s> and <font color>, None for drawings
+
+        :keep_alignment: bool: keeps {\\anN}, SRT players understand it
+        :escape: bool: escapes &, < and > of the text (VTT)
+        :keep_colors: bool: writes colors as <font color>, WebVTT has no such tag
+        """
+        plain = (lambda part: html.escape(part, quote=False)) if escape else str
+        output = []
+        position = 0
+        for block in cls.override_regex.finditer(text):
+            output.append(plain(text[position:block.start()]))
+            position = block.end()
+            for tag in cls.override_tag_regex.finditer(block.group(1)):
+                name, value, color, alignment, drawing = tag.groups()
+                if drawing:
+                    return None
+                if name:
+                    output.append(f"<{'/' if value == '0' else ''}{name}>")
+                elif alignment:
+                    if keep_alignment:
+                        output.append("{\\%s}" % alignment)
+                elif not keep_colors:
+                    continue
+                elif color:
+                    bgr = color.rjust(6, "0")[-6:].lower()
+                    output.append(f'<font color="#{bgr[4:6]}{bgr[2:4]}{bgr[0:2]}">')
+                else:
+                    output.append("</font>")
+        output.append(plain(text[position:]))
+        return "".join(output).replace("\\N", "\n").replace("\\n", "\n").replace("\\h", " ")
+
+    @classmethod
+    def text_events(cls, document, keep_alignment=True, escape=False, keep_colors=True):
+        """(start, end, text) of the dialogues in time order, comments and drawings are left out"""
+        for event in sorted(document.events, key=lambda event: event.start):
+            if event.kind != "Dialogue":
+                continue
+            text = cls.ass_to_html(event.text, keep_alignment, escape, keep_colors)
+            if text is not None and text.strip():
+                yield event.start, event.end, text
+
+    @classmethod
+    def lines(cls, document, subtitle_format):
+        if subtitle_format == "ass":
+            yield from document.lines()
+        elif subtitle_format == "srt":
+            for i, (start, end, text) in enumerate(cls.text_events(document)):
+                yield str(i + 1)
+                yield f"{Timestamp.format_srt(start)} --> {Timestamp.format_srt(end)}"
+                yield text
+                yield ""
+        else:
+            yield "WEBVTT"
+            yield ""
+            for start, end, text in cls.text_events(document, keep_alignment=False, escape=True, keep_colors=False):
+                yield f"{Timestamp.format_vtt(start)} --> {Timestamp.format_vtt(end)}"
+                yield text
+                yield ""
+
+    @classmethod
+    def write(cls, document, path, subtitle_format=None):
+        """Writes document as ASS, SRT or VTT (from the extension of path by default), through a temp file"""
+        subtitle_format = subtitle_format or cls.format_of(path)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for line in cls.lines(document, subtitle_format):
+                    file.write(line + "\n")
+            os.replace(temp_path, path)
+        except BaseException:
+            AssDocument.remove_temp(temp_path)
+            raise
+        return path
+
+    @classmethod
+    def convert(cls, source, target):
+        """Converts between ASS, SRT and VTT by extension, e.g: convert("episode.srt", "episode.ass")"""
+        return cls.write(cls.read(source), target)
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class Timeline:
+    """Start and end centiseconds of subtitle events as numpy arrays, with an interval index for time queries
+
+    arrays keep the order of the events given, queries return event positions in that order.
+    the index sorts events by start and keeps the running maximum of their ends, so a query only scans
+    the events that can still be active.
+    """
+
+    def __init__(self, starts, ends, duration=None):
+        """
+        :starts: array-like: event starts in centiseconds
+        :ends: array-like: event ends in centiseconds
+        :duration: int: media duration in centiseconds, the end of the last gap and the out of duration limit
+        """
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.duration = duration
+        self.order = np.argsort(self.starts, kind="stable")
+        self.sorted_starts = self.starts[self.order]
+        self.reach = np.maximum.accumulate(self.ends[self.order]) if len(self.order) else self.ends
+
+    @classmethod
+    def from_events(cls, events, duration=None):
+        events = events if isinstance(events, list) else list(events)
+        starts = np.fromiter((event.start for event in events), dtype=np.int64, count=len(events))
+        ends = np.fromiter((event.end for event in events), dtype=np.int64, count=len(events))
+        return cls(starts, ends, duration)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def gaps(self, min_length=0, after=0):
+        """(start, end) rows of the silences longer than min_length that end after `after`
+
+        a silence runs from the latest end so far to the next start, the one after the last event
+        ends at duration (when given). the time before the first event isn't a gap.
+        """
+        gap_starts = self.reach[:-1]
+        gap_ends = self.sorted_starts[1:]
+        if self.duration is not None and len(self.reach):
+            gap_starts = np.append(gap_starts, self.reach[-1])
+            gap_ends = np.append(gap_ends, self.duration)
+        mask = (gap_ends - gap_starts > min_length) & (gap_ends > after)
+        return np.column_stack((gap_starts[mask], gap_ends[mask]))
+
+    def overlaps(self):
+        """Mask of the events starting before an earlier starting event ended"""
+        mask = np.zeros(len(self), dtype=bool)
+        if len(self) > 1:
+            mask[self.order[1:]] = self.sorted_starts[1:] < self.reach[:-1]
+        return mask
+
+    def out_of_duration(self, duration=None):
+        """Mask of the events starting or ending after duration (centiseconds, defaults to self.duration)"""
+        duration = self.duration if duration is None else duration
+        return (self.starts > duration) | (self.ends > duration)
+
+    def histogram(self, bin_size=100, length=None):
+        """Active events per bin of bin_size centiseconds, up to length (defaults to duration or the last end)"""
+        length = length or self.duration or (int(self.ends.max()) if len(self) else 0)
+        bins = -(-length // bin_size)
+        first = np.clip(self.starts // bin_size, 0, bins)
+        last = np.clip(-(-self.ends // bin_size), 0, bins)
+        valid = (last > first) & (self.ends > self.starts)
+        changes = np.zeros(bins + 1, dtype=np.int64)
+        np.add.at(changes, first[valid], 1)
+        np.add.at(changes, last[valid], -1)
+        return np.cumsum(changes[:-1])
+
+    def active(self, start, end=None):
+        """Positions of the events active at start, or overlapping [start, end) when end is given"""
+        end = start + 1 if end is None else end
+        low = np.searchsorted(self.reach, start, side="right")
+        high = np.searchsorted(self.sorted_starts, end, side="left")
+        candidates = self.order[low:high]
+        return np.sort(candidates[self.ends[candidates] > start])
@@ -0,0 +1,75 @@
+from bisect import bisect_right
+
+
+class Timestamp:
+    """Subtitle timestamps as integer centiseconds, the unit of Event.start and Event.end
+
+    parsing and formatting are plain integer arithmetic (no datetime), ASS times round-trip exactly,
+    SRT/VTT milliseconds are rounded to the nearest centisecond.
+    """
+
+    @staticmethod
+    def parse(value):
+        """H:MM:SS.cc (ASS), HH:MM:SS,mmm (SRT) or [HH:]MM:SS.mmm (VTT) to centiseconds"""
+        parts = value.strip().split(":")
+        seconds, _, fraction = parts[-1].replace(",", ".").partition(".")
+        return Timestamp.from_parts(
+            parts[-3] if len(parts) > 2 else 0, parts[-2] if len(parts) > 1 else 0, seconds, fraction
+        )
+
+    @staticmethod
+    def from_parts(hours, minutes, seconds, fraction=None):
+        """Centiseconds of hours, minutes and seconds (strings or ints) and the digits after the decimal point"""
+        return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 100 + (int(((fraction or "") + "000")[:3]) + 5) // 10
+
+    @staticmethod
+    def format_ass(centiseconds):
+        """centiseconds to H:MM:SS.cc"""
+        centiseconds = max(int(centiseconds), 0)
+        return "%d:%02d:%02d.%02d" % (
+            centiseconds // 360000, centiseconds // 6000 % 60, centiseconds // 100 % 60, centiseconds % 100
+        )
+
+    @staticmethod
+    def format_srt(centiseconds):
+        """centiseconds to HH:MM:SS,mmm"""
+        centiseconds = max(int(centiseconds), 0)
+        return "%02d:%02d:%02d,%03d" % (
+            centiseconds // 360000, centiseconds // 6000 % 60, centiseconds // 100 % 60, centiseconds % 100 * 10
+        )
+
+    @staticmethod
+    def format_vtt(centiseconds):
+        """centiseconds to HH:MM:SS.mmm"""
+        centiseconds = max(int(centiseconds), 0)
+        return "%02d:%02d:%02d.%03d" % (
+            centiseconds // 360000, centiseconds // 6000 % 60, centiseconds // 100 % 60, centiseconds % 100 * 10
+        )
+
+    @staticmethod
+    def from_seconds(seconds):
+        return round(float(seconds) * 100)
+
+    @staticmethod
+    def to_seconds(centiseconds):
+        return centiseconds / 100
+
+    @staticmethod
+    def retime(shift=0, ranges=None, scale=1.0, minimum=0):
+        """Builds a transform moving an event's start and end to time * scale + shift, at least minimum
+
+        :shift: int: centiseconds added to every event
+        :ranges: list: (from, shift) centisecond pairs, events starting at or after from take that shift instead
+        :scale: float: drift correction e.g: 23.976 / 25 for a subtitle timed on 23.976fps played on a 25fps video
+        """
+        ranges = sorted(ranges or [])
+        bounds = [start for start, _ in ranges]
+        shifts = [shift] + [offset for _, offset in ranges]
+
+        def transform(event):
+            offset = shifts[bisect_right(bounds, event.start)]
+            event.start = max(round(event.start * scale) + offset, minimum)
+            event.end = max(round(event.end * scale) + offset, minimum)
+            return event
+
+        return transform
@@ -0,0 +1,235 @@
+import os
+import time
+import threading
+import libtorrent as lt
+from tqdm import tqdm
+from core.utils import Utils
+from core import config
+
+
+class TorrentEngine:
+    """Runs every torrent on one long lived libtorrent session, driven by its alerts instead of polling
+
+    only the video files of a torrent (and the config.torrent['keep_extensions'] ones) are downloaded,
+    the whole torrent when it has no video. resume data is saved every resume_interval seconds, when a torrent
+    finishes and when it's canceled, adding the same torrent again (after a restart too) starts from it
+    instead of checking every piece.
+    """
+    _instance = None
+    alert_mask = lt.alert_category.error | lt.alert_category.status | lt.alert_category.storage
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.session = None
+            cls._instance.torrents = {}
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self, resume_path=None, settings=None):
+        """
+        :resume_path: str: folder of the <info hash>.fastresume files, defaults to config.torrent['resume_path']
+        :settings: dict: libtorrent settings_pack entries over config.torrent['settings'] e.g: {"download_rate_limit": 0}
+        """
+        self.utils = Utils()
+        if self.session is None:
+            self.resume_path = resume_path or config.torrent['resume_path']
+            self.utils.check_folder(self.resume_path)
+            # a magnet is finished (nothing wanted) between its metadata and select_files, redundant connections
+            # closed then would drop the seeds it got the metadata from
+            self.session = lt.session({**config.torrent['settings'], **(settings or {}), 'alert_mask': self.alert_mask,
+                                       'close_redundant_connections': False})
+            self.last_update = 0
+            self.last_save = time.monotonic()
+
+    def resume_file(self, info_hash):
+        return os.path.join(self.resume_path, f"{info_hash}.fastresume")
+
+    def add(self, link, save_path="assets/media", sequential=None, download_limit=0, upload_limit=0):
+        """Adds a magnet link or a .torrent file to the session, returns its info hash
+
+        :sequential: bool: fetches pieces in order, defaults to config.torrent['sequential']
+        :download_limit: int: bytes/s for this torrent, 0 is unlimited (the session limit still applies)
+        :upload_limit: int: bytes/s for this torrent, 0 is unlimited
+        """
+        if link.startswith("magnet:"):
+            params = lt.parse_magnet_uri(link)
+            info_hash = str(params.info_hashes.get_best())
+        elif os.path.isfile(link):
+            params = lt.add_torrent_params()
+            params.ti = lt.torrent_info(link)
+            info_hash = str(params.ti.info_hashes().get_best())
+        else:
+            raise ValueError(f"{link} is neither a magnet link nor a .torrent file")
+
+        with self.lock:
+            if info_hash in self.torrents:
+                return info_hash
+
+            resume_file = self.resume_file(info_hash)
+            if os.path.exists(resume_file):
+                with open(resume_file, 'rb') as file:
+                    resumed = lt.read_resume_data(file.read())
+                resumed.peers = resumed.peers + params.peers
+                params = resumed
+
+            params.save_path = os.path.abspath(save_path)
+            # nothing is fetched before select_files picked the files
+            params.flags |= lt.torrent_flags.default_dont_download
+            if config.torrent['sequential'] if sequential is None else sequential:
+                params.flags |= lt.torrent_flags.sequential_download
+            else:
+                params.flags &= ~lt.torrent_flags.sequential_download
+            params.download_limit = download_limit
+            params.upload_limit = upload_limit
+
+            torrent = {
+                "info_hash": info_hash,
+                "handle": self.session.add_torrent(params),
+                "save_path": params.save_path,
+                "files": [],
+                "selected": False,
+                "finished": False,
+                "saving": 0,
+                "error": None,
+                "wanted": 0,
+                "done": 0,
+            }
+            self.torrents[info_hash] = torrent
+            if torrent["handle"].torrent_file() is not None:
+                self.select_files(torrent)
+        return info_hash
+
+    def select_files(self, torrent):
+        files = torrent["handle"].torrent_file().files()
+        paths = {}
+        for i in range(files.num_files()):
+            if not files.file_flags(i) & lt.file_storage.flag_pad_file:
+                paths[i] = files.file_path(i)
+
+        extensions = {i: os.path.splitext(path)[1].lower() for i, path in paths.items()}
+        wanted = [i for i in paths if extensions[i] in config.video_extensions]
+        if wanted:
+            wanted += [i for i in paths if extensions[i] in config.torrent['keep_extensions']]
+        else:
+            wanted = list(paths)
+
+        torrent["handle"].prioritize_files([4 if i in wanted else 0 for i in range(files.num_files())])
+        torrent["files"] = [os.path.join(torrent["save_path"], paths[i]) for i in sorted(wanted)]
+        torrent["selected"] = True
+
+    def find(self, handle):
+        for torrent in self.torrents.values():
+            if torrent["handle"] == handle:
+                return torrent
+        return None
+
+    def save_resume(self, torrent, only_if_modified=False):
+        handle = torrent["handle"]
+        if not handle.is_valid() or (only_if_modified and not handle.need_save_resume_data()):
+            return
+        torrent["saving"] += 1
+        handle.save_resume_data(lt.save_resume_flags_t.save_info_dict)
+
+    def update(self, torrent, status):
+        torrent["wanted"] = status.total_wanted
+        torrent["done"] = status.total_wanted_done
+        # before select_files every file has priority 0, nothing wanted looks finished
+        if torrent["selected"] and not torrent["finished"] and status.is_finished and status.total_wanted:
+            torrent["finished"] = True
+            self.save_resume(torrent)
+
+    def handle_alert(self, alert):
+        if isinstance(alert, lt.state_update_alert):
+            for status in alert.status:
+                torrent = self.find(status.handle)
+                if torrent:
+                    self.update(torrent, status)
+            return
+
+        torrent = self.find(alert.handle) if isinstance(alert, lt.torrent_alert) else None
+        if torrent is None:
+            return
+        if isinstance(alert, lt.metadata_received_alert):
+            self.select_files(torrent)
+        elif isinstance(alert, lt.torrent_finished_alert):
+            self.update(torrent, alert.handle.status())
+        elif isinstance(alert, lt.save_resume_data_alert):
+            torrent["saving"] -= 1
+            temp_path = f"{self.resume_file(torrent['info_hash'])}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(lt.write_resume_data_buf(alert.params))
+            os.replace(temp_path, temp_path[:-len(".tmp")])
+        elif isinstance(alert, lt.save_resume_data_failed_alert):
+            torrent["saving"] -= 1
+        elif isinstance(alert, (lt.torrent_error_alert, lt.file_error_alert, lt.metadata_failed_alert)):
+            torrent["error"] = alert.message()
+
+    def pump(self, timeout=0.5):
+        """Waits up to timeout seconds for alerts and applies them, the threads waiting on torrents take turns"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_update >= 1:
+                self.last_update = now
+                self.session.post_torrent_updates()
+            if now - self.last_save >= config.torrent['resume_interval']:
+                self.last_save = now
+                for torrent in self.torrents.values():
+                    self.save_resume(torrent, only_if_modified=True)
+            self.session.wait_for_alert(int(timeout * 1000))
+            for alert in self.session.pop_alerts():
+                self.handle_alert(alert)
+
+    def remove(self, info_hash, timeout=10):
+        """Saves the resume data of a torrent and takes it off the session, its files stay"""
+        torrent = self.torrents.get(info_hash)
+        if torrent is None:
+            return
+        if not torrent["finished"]:
+            self.save_resume(torrent)
+        deadline = time.monotonic() + timeout
+        while torrent["saving"] > 0 and time.monotonic() < deadline:
+            self.pump(0.1)
+        with self.lock:
+            self.session.remove_torrent(torrent["handle"])
+            del self.torrents[info_hash]
+
+    def wait(self, info_hash, cancel_token=None, progress_bar=True):
+        """Runs the torrent until its selected files are downloaded and returns their paths, None when canceled
+
+        a finished torrent keeps seeding while the session runs when config.torrent['seed'] is set.
+        """
+        torrent = self.torrents[info_hash]
+        pbar = None
+        try:
+            while not torrent["finished"] or torrent["saving"] > 0:
+                if torrent["error"]:
+                    error = torrent["error"]
+                    self.remove(info_hash)
+                    raise ValueError(f"torrent {info_hash} failed, {error}")
+                if cancel_token and cancel_token.is_canceled():
+                    self.remove(info_hash)
+                    return None
+                self.pump()
+                if progress_bar and torrent["wanted"]:
+                    if pbar is None:
+                        pbar = tqdm(
+                            total=torrent["wanted"], unit='B', unit_scale=True,
+                            desc=f"Downloading {torrent['handle'].status().name}",
+                            bar_format='{desc} {percentage:3.0f}% |{rate_fmt}{postfix}'
+                        )
+                    pbar.update(torrent["done"] - pbar.n)
+        finally:
+            if pbar is not None:
+                pbar.close()
+
+        if not config.torrent['seed']:
+            self.remove(info_hash)
+        return torrent["files"]
+
+    def close(self):
+        """Saves the resume data of every torrent and ends the session"""
+        for info_hash in list(self.torrents):
+            self.remove(info_hash)
+        with self.lock:
+            self.session = None
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from core import config
+
+
+class TranslationMemory:
+    """Persistent translations keyed by normalized dialogue + its prev/next context + language pair
+
+    Translation looks dialogues up here before calling a backend and stores every finished batch
+    right away, so a crashed job resumes with only the dialogues it hasn't translated yet.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.connection = None
+            cls._instance.path = None
+            cls._instance.hits = 0
+            cls._instance.misses = 0
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self, path=None):
+        if self.path is None:
+            self.path = config.translation_memory['path']
+        if path and path != self.path:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.path = path
+
+    def connect(self):
+        if self.connection is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, source TEXT, translated TEXT, created REAL)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split()).casefold()
+
+    def key(self, dialogue, source, target):
+        data = json.dumps([
+            source,
+            target,
+            self.normalize(dialogue["en"]),
+            [self.normalize(text) for text in dialogue["prev_dialogues"]],
+            [self.normalize(text) for text in dialogue["next_dialogues"]],
+        ], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """Returns {key: translation} for the keys already translated"""
+        found = {}
+        unique_keys = list(set(keys))
+        with self.lock:
+            connection = self.connect()
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, translated FROM translations WHERE key IN ({', '.join(['?'] * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """Stores (key, source text, translation) tuples"""
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO translations (key, source, translated, created) VALUES (?, ?, ?, ?)",
+                [(key, source, translated, now) for key, source, translated in items]
+            )
+            connection.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0}
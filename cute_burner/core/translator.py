@@ -0,0 +1,203 @@
+import re
+import time
+import random
+import threading
+import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.utils import Utils
+from core.translation_memory import TranslationMemory
+
+
+class TranslationMismatch(ValueError):
+    """The backend returned a different number of lines than it was sent, retrying the same batch won't help"""
+
+
+class TranslatorBackend:
+    """Translator backend interface
+
+    translate receives a batch of texts and returns their translations in the same order,
+    raise an exception to make Translation retry the batch, TranslationMismatch to skip straight to one line per request.
+    """
+
+    def translate(self, texts, source, target):
+        raise NotImplementedError
+
+
+class GoogleBackend(TranslatorBackend):
+    """googletrans with deep_translator's GoogleTranslator as fallback, one request per batch"""
+    separator = "\n"
+
+    def __init__(self, proxies=None):
+        from googletrans import Translator
+
+        # proxies = {
+        #     'http': 'http://your_proxy_ip:your_proxy_port',
+        #     'https': 'https://your_proxy_ip:your_proxy_port'
+        # }
+        self.translator = Translator(proxies=proxies) if proxies else Translator()
+        self.fallbacks = {}
+
+    def fallback(self, source, target):
+        from deep_translator import GoogleTranslator
+
+        if (source, target) not in self.fallbacks:
+            self.fallbacks[(source, target)] = GoogleTranslator(source=source, target=target)
+        return self.fallbacks[(source, target)]
+
+    def translate(self, texts, source, target):
+        text = self.separator.join(texts)
+        try:
+            translated = self.translator.translate(text, src=source, dest=target).text
+        except Exception:
+            translated = self.fallback(source, target).translate(text)
+
+        translated = translated.split(self.separator)
+        if len(translated) != len(texts):
+            raise TranslationMismatch(f"expected {len(texts)} translations, got {len(translated)}")
+        return translated
+
+
+class StubBackend(TranslatorBackend):
+    """Offline backend for tests, translates with a local function and can fail on purpose
+
+    :translate_text: callable: text -> translated text, defaults to upper-casing
+    :fail_times: int: number of first calls raising an error to exercise the retries
+    """
+
+    def __init__(self, translate_text=None, fail_times=0):
+        self.translate_text = translate_text or (lambda text: text.upper())
+        self.fail_times = fail_times
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def translate(self, texts, source, target):
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.fail_times:
+                raise ConnectionError("stub backend failure")
+        return [self.translate_text(text) for text in texts]
+
+
+class RateLimiter:
+    """Spaces requests at least 1 / requests_per_second apart across all threads"""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Translation:
+    """Translates dialogues in concurrent batches
+
+    every dialogue is sent with its context as produced by Utils.concat_dialogue
+    ("prev [~]dialogue[~] next") and only the text between the [~] markers is kept,
+    batches whose markers don't survive are retried one dialogue per request, with fallback_retries attempts each
+    and none once the backend raised, so a failing backend costs one backoff per batch, not one per dialogue.
+    dialogues found in the translation memory are never sent, pass memory=False to disable it.
+    """
+    marker_regex = re.compile(r'\[~](.*?)\[~]')
+
+    def __init__(self, backend=None, source="en", target="fa", batch_size=20, max_workers=4,
+                 requests_per_second=5, retries=5, backoff=1, untranslated="بدون ترجمه", show_progress=True, memory=None,
+                 fallback_retries=1):
+        self.utils = Utils()
+        self.backend = backend or GoogleBackend()
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.retries = retries
+        self.fallback_retries = fallback_retries
+        self.backoff = backoff
+        self.untranslated = untranslated
+        self.show_progress = show_progress
+        self.memory = TranslationMemory() if memory is None else memory
+
+    def request(self, texts, retries=None):
+        """Calls the backend with rate limiting and exponential backoff, retries defaults to self.retries attempts
+
+        a line count mismatch is raised right away, the same batch would come back the same way
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries):
+            self.rate_limiter.wait()
+            try:
+                translated = self.backend.translate(texts, self.source, self.target)
+                if len(translated) != len(texts):
+                    raise TranslationMismatch(f"expected {len(texts)} translations, got {len(translated)}")
+                return translated
+            except TranslationMismatch:
+                raise
+            except Exception:
+                if attempt + 1 == retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    def extract(self, translated):
+        found = self.marker_regex.findall(translated or "")
+        return found[0] if found else None
+
+    def translate_batch(self, texts):
+        results = [None] * len(texts)
+        try:
+            results = [self.extract(text) for text in self.request(texts)]
+        except Exception:
+            pass
+
+        backend_failed = not self.fallback_retries
+        for i, text in enumerate(texts):
+            if results[i] is None and len(texts) > 1 and not backend_failed:
+                try:
+                    results[i] = self.extract(self.request([text], self.fallback_retries)[0])
+                except Exception:
+                    backend_failed = True
+            if results[i] is None:
+                results[i] = self.untranslated
+        return results
+
+    def translate(self, dialogues):
+        """Returns the translation of every dialogue, in the same order"""
+        texts = [self.utils.concat_dialogue(dialogue) for dialogue in dialogues]
+        results = [None] * len(texts)
+
+        keys = []
+        if self.memory:
+            keys = [self.memory.key(dialogue, self.source, self.target) for dialogue in dialogues]
+            translated = self.memory.get_many(keys)
+            for i, key in enumerate(keys):
+                results[i] = translated.get(key)
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+
+        progress_bar = tqdm.tqdm(total=len(texts), initial=len(texts) - len(pending), unit="line",
+                                 desc="Translating", ascii=True, disable=not self.show_progress)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.translate_batch, [texts[i] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                checkpoint = []
+                for i, translated in zip(batch, future.result()):
+                    results[i] = translated
+                    if self.memory and translated != self.untranslated:
+                        checkpoint.append((keys[i], dialogues[i]["en"], translated))
+                if checkpoint:
+                    self.memory.put_many(checkpoint)
+                progress_bar.update(len(batch))
+        progress_bar.close()
+
+        if self.memory:
+            saved = len(texts) - len(pending)
+            print(f"Translation memory: {saved}/{len(texts)} dialogues reused, {len(batches)} batches sent")
+
+        return results
@@ -0,0 +1,198 @@
+import os
+import math
+import json
+import threading
+import subprocess
+from core import config
+
+
+class Tuning:
+    """Picks the encoder and its threading for this machine and the number of jobs running at once
+
+    usable cores come from the cpu affinity mask capped by the cgroup cpu quota (containers),
+    available encoders from `ffmpeg -encoders`. the fps measured by every finished encode is kept
+    per encoder, resolution, preset, jobs and threads in a json file, later runs use the fastest known setting.
+    """
+    _instance = None
+    cpu_encoders = {"h265": ["libx265"], "av1": ["libaom-av1", "libsvtav1"]}
+    gpu_encoders = {"h265": ["hevc_nvenc", "hevc_qsv", "hevc_vaapi"], "av1": ["av1_nvenc", "av1_qsv", "libsvtav1"]}
+    # preferred order when nothing was measured yet, fastest software encoder first
+    auto_encoders = {"h265": ["libx265"], "av1": ["libsvtav1", "libaom-av1"]}
+    hardware_suffixes = ("_nvenc", "_qsv", "_vaapi", "_amf", "_videotoolbox")
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.path = None
+            cls._instance.available = None
+            cls._instance.records = None
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self, path=None):
+        if self.path is None:
+            self.path = config.tuning['path']
+        if path and path != self.path:
+            self.path = path
+            self.records = None
+
+    @staticmethod
+    def cpu_quota():
+        """cpus allowed by the cgroup (v2 then v1), None when unlimited"""
+        try:
+            with open("/sys/fs/cgroup/cpu.max") as file:
+                quota, period = file.read().split()[:2]
+            if quota != "max":
+                return int(quota) / int(period)
+            return None
+        except (OSError, ValueError):
+            pass
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+                quota = int(file.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+                period = int(file.read())
+            if quota > 0 and period > 0:
+                return quota / period
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def cpu_count(self):
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = os.cpu_count() or 1
+        quota = self.cpu_quota()
+        if quota:
+            cores = min(cores, math.ceil(quota))
+        return max(cores, 1)
+
+    def encoders(self):
+        """Names of the video encoders this ffmpeg build exposes"""
+        if self.available is None:
+            self.available = set()
+            try:
+                output = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+            except OSError:
+                return self.available
+            listing = False
+            for line in output.splitlines():
+                fields = line.split()
+                if fields and fields[0].startswith("---"):
+                    listing = True
+                elif listing and len(fields) > 1 and fields[0].startswith("V"):
+                    self.available.add(fields[1])
+        return self.available
+
+    @classmethod
+    def is_hardware(cls, vcodec):
+        return bool(vcodec) and vcodec.endswith(cls.hardware_suffixes)
+
+    def encoder(self, codec, processor="cpu", height=None, preset=None):
+        """Resolves codec (h265, av1) and processor (cpu, gpu, auto) to an encoder ffmpeg can run
+
+        auto picks the fastest encoder measured so far for the resolution and preset,
+        or the fastest software encoder available when nothing was measured.
+        """
+        if codec not in self.cpu_encoders:
+            raise ValueError(f"unknown codec {codec}")
+        available = self.encoders()
+        if processor == "cpu":
+            candidates = self.cpu_encoders[codec]
+        elif processor == "gpu":
+            candidates = self.gpu_encoders[codec]
+        elif processor == "auto":
+            candidates = self.auto_encoders[codec] + self.gpu_encoders[codec]
+            measured = [(self.best(encoder, height, preset)[1], encoder)
+                        for encoder in candidates if encoder in available]
+            measured = [item for item in measured if item[0]]
+            if measured:
+                return max(measured)[1]
+            candidates = self.auto_encoders[codec]
+        else:
+            raise ValueError(f"unknown processor {processor}, options is: cpu, gpu, auto")
+
+        for encoder in candidates:
+            if not available or encoder in available:
+                return encoder
+        raise ValueError(f"ffmpeg has no {processor} encoder for {codec}, tried {', '.join(candidates)}")
+
+    @staticmethod
+    def frame_threads(threads):
+        """x265's own frame-threads table for a pool of this size"""
+        if threads >= 32:
+            return 6
+        if threads >= 16:
+            return 5
+        if threads >= 8:
+            return 3
+        if threads >= 4:
+            return 2
+        return 1
+
+    def thread_count(self, vcodec, height=None, preset=None, jobs=1):
+        threads, _ = self.best(vcodec, height, preset, jobs)
+        return threads or max(1, self.cpu_count() // max(jobs, 1))
+
+    def options(self, vcodec, height=None, preset=None, jobs=1, threads=None):
+        """ffmpeg output options sharing the cores between jobs concurrent encodes
+
+        :vcodec: str: ffmpeg encoder name e.g: libx265
+        :jobs: int: encodes running at the same time (Batch workers, chunked segments)
+        :threads: int: forces the thread count instead of the fastest measured one
+        """
+        threads = threads or self.thread_count(vcodec, height, preset, jobs)
+        options = {"threads": threads}
+        if vcodec == "libx265":
+            options["x265-params"] = f"pools={threads}:frame-threads={self.frame_threads(threads)}"
+        elif vcodec == "libsvtav1":
+            options["svtav1-params"] = f"lp={threads}"
+        elif vcodec == "libaom-av1":
+            options["row-mt"] = 1
+        return options
+
+    @staticmethod
+    def record_key(vcodec, height, preset):
+        return f"{vcodec}|{height or 'source'}|{preset or 'default'}"
+
+    def load(self):
+        if self.records is None:
+            self.records = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as file:
+                        self.records = json.load(file)
+                except (OSError, ValueError):
+                    self.records = {}
+        return self.records
+
+    def best(self, vcodec, height=None, preset=None, jobs=None):
+        """(threads, fps) of the fastest measured run, for a given jobs count or any"""
+        with self.lock:
+            runs = self.load().get(self.record_key(vcodec, height, preset), {})
+        best = (None, 0)
+        for setting, record in runs.items():
+            setting_jobs, setting_threads = (int(value) for value in setting.split("x"))
+            if (jobs is None or setting_jobs == jobs) and record["fps"] > best[1]:
+                best = (setting_threads, record["fps"])
+        return best
+
+    def record(self, vcodec, height, preset, jobs, threads, fps):
+        """Adds a measured fps to the running average of a setting"""
+        if not vcodec or vcodec == "copy" or not fps:
+            return
+        with self.lock:
+            self.records = None
+            runs = self.load().setdefault(self.record_key(vcodec, height, preset), {})
+            record = runs.setdefault(f"{jobs}x{threads}", {"fps": 0, "runs": 0})
+            record["fps"] = (record["fps"] * record["runs"] + fps) / (record["runs"] + 1)
+            record["runs"] += 1
+
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.records, file, indent=2)
+            os.replace(temp_path, self.path)
@@ -1,11 +1,10 @@
 import os
 import random
 import string
-import tqdm
-import time
 import shutil
 import textwrap
 import ffmpeg
+from core.probe_cache import ProbeCache
 from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
@@ -13,7 +12,6 @@ from mysql.connector import Error
 
 class Utils:
     _instance = None
-    progress_bar_current_time = 0
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -27,10 +25,6 @@ class Utils:
         else:
             os.system('printf "\033c"')
 
-    @staticmethod
-    def parse_time(time_str):
-        return datetime.strptime(time_str, "%H:%M:%S.%f")
-
     @staticmethod
     def get_now():
         now = datetime.now()
@@ -94,42 +88,6 @@ class Utils:
 
         return text
 
-    def write_line_into_file(self, file_path: str, data: dict):
-        self.validate_file(file_path)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        new_lines = []
-        for i, line in enumerate(lines):
-            pass_line = False
-            if "script_info" in data and '[Script Info]' in lines[i - 1]:
-                new_lines.append('\n'.join([f"{item}" for item in data['script_info']]) + '\n')
-            elif "player_res" in data and 'Styles]' in line and 'Format:' in lines[i + 1]:
-                new_lines.append('\n'.join([f"{item}" for item in data['player_res']]) + '\n')
-            elif "font" in data:
-                font_name = data['font'][0]
-                font_name = os.path.basename(self.remove_file_extension(font_name))
-                if 'Style:' in line:
-                    pass_line = True
-                elif 'Format:' in line and 'Styles]' in lines[i - 1]:
-                    new_lines.append(
-                        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding"
-                    )
-                    new_lines.append(
-                        '\n' + f"Style: Default,{font_name},70,&H26D9D9&,&H000000FF,&H00000000,&H00000000,-1,0,0,0,100,100,0,0,1,2.50001,0,2,20,20,30,1"
-                    )
-                    pass_line = True
-                elif '[Events]' in line:
-                    new_lines.append('\n\n' + '[Fonts]' + '\n' + f"fontname: {font_name}" + '\n\n')
-
-            if not pass_line:
-                new_lines.append(line)
-            if "append" in data and i + 1 == len(lines):
-                new_lines.append('\n'.join([f"{item}" for item in data['append']]) + '\n')
-
-        with open(file_path, 'w', encoding='utf-8') as main_file:
-            main_file.writelines(new_lines)
-
     @staticmethod
     def get_file_extension(file, default="mkv"):
         last_dot_index = file.rfind(".")
@@ -254,67 +212,12 @@ class Utils:
         video_stream = input_stream.video or None
         audio_stream = input_stream.audio or None
 
-        media_info = ffmpeg.probe(media_path)
+        media_info = ProbeCache().probe(media_path)
         subtitle_streams = [input_stream[str(stream['index'])] for stream in media_info['streams'] if stream['codec_type'] == 'subtitle']
         media_duration = float(media_info["format"]["duration"])
 
         return [video_stream, audio_stream, subtitle_streams, media_duration, media_info]
 
-    def generate_progress_bar(self, media_duration, media_output_path, progress_file, rest=1, remove_media=None):
-        self.progress_bar_current_time = 0
-        keys = ["progress", "frame", "fps", "stream_0_0_q", "bitrate", "total_size",
-                "out_time_us", "out_time_ms", "out_time", "dup_frames", "drop_frames", "speed"]
-
-        progress_bar = tqdm.tqdm(total=media_duration, initial=0, unit="s",
-                                 desc=f"Processing {media_output_path}",
-                                 ascii=True,
-                                 bar_format='{desc} {percentage:3.0f}% | {n:.2f}s/{total:.2f}s |{rate_fmt}{postfix}')
-
-        i = 0
-        while True:
-            if not os.path.exists(progress_file):
-                i = i + 1
-                if i >= 10:
-                    break
-                time.sleep(rest)
-            else:
-                last_values = {}
-                with open(progress_file, 'r') as file:
-                    reversed_lines = reversed(file.readlines())
-
-                    for line in reversed_lines:
-                        key, value = line.strip().split("=")
-
-                        if key in keys:
-                            last_values[key] = value
-
-                        if all(key in last_values for key in keys):
-                            break
-
-                if len(last_values) > 0:
-                    if last_values['progress'] == 'end':
-                        progress_bar.close()
-                        if remove_media and len(remove_media) > 0:
-                            for media in remove_media:
-                                os.remove(media)
-                        os.remove(progress_file)
-                        break
-                    if last_values['out_time'] != "N/A" and last_values['speed'] != "N/A":
-                        self.progress_bar_current_time = self.time_to_seconds(last_values['out_time'])
-                        speed = float(last_values['speed'].replace('x', ''))
-                        remaining_time = (media_duration - self.progress_bar_current_time) / speed
-                        estimated_finish_time = time.strftime("%H:%M:%S", time.gmtime(remaining_time))
-                        progress_bar.set_description(
-                            f"Processing {media_output_path} (Est Finish {estimated_finish_time})"
-                        )
-                else:
-                    self.progress_bar_current_time = 0
-
-                progress_bar.n = self.progress_bar_current_time
-                progress_bar.refresh()
-
-                time.sleep(rest)
-
     @staticmethod
     def handle_long_dialogue(dialogue, max_width=45):
         lines = textwrap.wrap(dialogue, width=max_width)
@@ -331,42 +234,6 @@ class Utils:
         else:
             return dialogue
 
-    @staticmethod
-    def get_dialogue_format(lines):
-        for i, line in enumerate(lines):
-            if "Format:" in line and i > 0 and "[Events]" in lines[i - 1]:
-                return line.strip()
-        raise ValueError("No Format line found in the subtitle file.")
-
-    @staticmethod
-    def get_text_field_index(format_line):
-        fields = format_line.strip().split(": ")[1].split(", ")
-        if len(fields) == 1:
-            fields = fields[0].split(",")
-        try:
-            return fields.index("Text")
-        except ValueError:
-            raise ValueError("No 'Text' field found in the Format line.")
-
-    @staticmethod
-    def shift_time(time_str, shift_seconds):
-        """Shift a timestamp by the given number of seconds."""
-        hours, minutes, seconds = time_str.split(':')
-        total_seconds = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-        total_seconds += shift_seconds
-
-        # Handle negative time shift
-        if total_seconds < 0:
-            total_seconds = 0
-
-        # Convert back to hours, minutes, and seconds
-        hours = int(total_seconds // 3600)
-        total_seconds %= 3600
-        minutes = int(total_seconds // 60)
-        seconds = total_seconds % 60
-
-        return f"{hours:01}:{minutes:02}:{seconds:05.2f}"
-
     @staticmethod
     def concat_dialogue(dialogue):
         dialogue_text = ""
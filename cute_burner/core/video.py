@@ -1,30 +1,49 @@
 import os
+import math
 import ffmpeg
 import sys
 import shutil
 import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from core.utils import Utils
+from core.progress import Progress, ProgressBar, ProgressCallback
+from core.probe_cache import ProbeCache
+from core.tuning import Tuning
+from core.timestamp import Timestamp
+from core import config
 
 
 class Video:
     _instance = None
+    resolutions = {"1080": (1920, 1080), "720": (1280, 720), "480": (854, 480)}
+    # audio output format: (encoder, codec name of a stream that can be copied into it)
+    audio_formats = {"mp3": ("libmp3lame", "mp3"), "aac": ("aac", "aac"), "wav": ("pcm_s16le", "pcm_s16le")}
+    # encoder, its params option and the bitstream filter putting the source parameter sets in band, for smart trim
+    smart_trim_encoders = {"h264": ("libx264", "x264-params", "h264_mp4toannexb"),
+                           "hevc": ("libx265", "x265-params", "hevc_mp4toannexb")}
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, media_path, font_path, fonts_dir, base_path="assets/media", show_log=False):
+    def __init__(self, media_path, font_path, fonts_dir, base_path="assets/media", show_log=False, jobs=1):
+        """
+        :jobs: int: encodes running at the same time on this machine (e.g: Batch workers), threads are shared between them
+        """
         self.utils = Utils()
         self.base_path = base_path
-        self.media_path = self.utils.check_extension(f"{self.base_path}/{media_path}", "mkv")
-        self.media_output_path = self.utils.append_random_name(self.media_path)
+        self.media_path = f"{self.base_path}/{media_path}"
+        # any container of config.video_extensions is read as is, outputs are mkv
+        if os.path.splitext(self.media_path)[1].lower() not in config.video_extensions:
+            self.media_path = self.utils.check_extension(self.media_path, "mkv")
+        self.media_output_path = self.utils.check_extension(self.utils.append_random_name(self.media_path), "mkv")
         self.show_ffmpeg_log = not show_log
-        self.progress_file_path = self.utils.append_random_name(f"{self.base_path}/progress.txt")
 
         self.utils.check_folder(base_path)
         self.utils.validate_file(self.media_path, False)
-        self.utils.validate_file(self.progress_file_path, True)
 
         self.font_path = font_path
         self.utils.validate_file(self.font_path)
@@ -35,6 +54,12 @@ class Video:
         self.move_path = None
         self._trim = None
         self._frame = None
+        self._ladder = None
+        self._chunked = None
+        self._scale = None
+        self._threads = None
+        self.jobs = jobs
+        self.media_output_paths = []
         self.output_options = {"acodec": "copy", "vcodec": "copy"}
         self.video_stream, self.audio_stream, self.subtitle_streams, self.media_duration, self.video_info = self.utils.media_streams(
             self.media_path)
@@ -65,19 +90,60 @@ class Video:
         pass
 
     def extract_audio(self, audio_type="mp3"):
-        output = self.utils.append_random_name(self.media_path, "audio")
-        if audio_type == "mp3":
-            output = self.utils.remove_file_extension(output, audio_type)
-            ffmpeg_inst = ffmpeg.input(self.media_path).output(f"{self.base_path}/{output}", progress=self.progress_file_path, acodec='libmp3lame')
-        elif audio_type == "aac":
-            output = self.utils.remove_file_extension(output, audio_type)
-            ffmpeg_inst = ffmpeg.input(self.media_path).output(f"{self.base_path}/{output}", progress=self.progress_file_path, acodec='aac')
-        else:  # "wav"
-            output = self.utils.remove_file_extension(output, audio_type)
-            ffmpeg_inst = ffmpeg.input(self.media_path).output(f"{self.base_path}/{output}", progress=self.progress_file_path, acodec='pcm_s16le')
-
-        ffmpeg.run_async(ffmpeg_inst, overwrite_output=True, quiet=self.show_ffmpeg_log)
-        self.utils.generate_progress_bar(self.media_duration, output, self.progress_file_path)
+        """Extracts the default audio stream to mp3, aac or wav, returns the written path"""
+        audio_type = audio_type if audio_type in ("mp3", "aac") else "wav"
+        return self.extract_audios([{"format": audio_type}])[0]
+
+    def extract_audios(self, targets, progress_bar=True):
+        """Extracts several audio outputs reading the media once
+
+        :targets: list: per output {"stream": source stream index (defaults to the first audio stream),
+            "format": mp3, aac or wav, "bitrate": e.g: 192k}
+            e.g: [{"format": "aac"}, {"stream": 2, "format": "mp3", "bitrate": "128k"}, {"stream": 2, "format": "wav"}]
+        a stream already in the requested format is copied unless a bitrate is given. returns the written paths
+        """
+        if len(targets) == 0:
+            raise ValueError("specify at least one audio target")
+        audio_streams = {stream['index']: stream for stream in self.video_info['streams'] if stream['codec_type'] == 'audio'}
+        if not audio_streams:
+            raise ValueError(f"{self.media_path} has no audio stream")
+
+        source = ffmpeg.input(self.media_path)
+        base = self.utils.remove_file_extension(self.utils.append_random_name(self.media_path, "audio")).replace(":", " ")
+        outputs = []
+        paths = []
+        for target in targets:
+            index = target.get("stream", min(audio_streams))
+            audio_format = target.get("format", "mp3")
+            bitrate = target.get("bitrate")
+            if index not in audio_streams:
+                raise ValueError(f"stream {index} is not an audio stream of {self.media_path}")
+            if audio_format not in self.audio_formats:
+                raise ValueError(f"unknown audio format {audio_format}, options is: {', '.join(self.audio_formats)}")
+
+            encoder, codec_name = self.audio_formats[audio_format]
+            if audio_streams[index].get('codec_name') == codec_name and not bitrate:
+                options = {"acodec": "copy"}
+            else:
+                options = {"acodec": encoder}
+                if bitrate:
+                    options["b:a"] = bitrate
+
+            path = f"{base}_{index}_{bitrate}.{audio_format}" if bitrate else f"{base}_{index}.{audio_format}"
+            if path in paths:
+                raise ValueError(f"audio target {target} is requested more than once")
+            paths.append(path)
+            outputs.append(source[str(index)].output(path, **options))
+
+        command = ffmpeg.merge_outputs(*outputs).global_args("-progress", "pipe:1")
+        progress = Progress([ProgressBar(self.media_duration, base)] if progress_bar else [])
+        if progress.run(command, quiet=self.show_ffmpeg_log) != 0:
+            for path in paths:
+                self.utils.validate_file(path, True)
+            raise ValueError(f"ffmpeg failed to extract audio into {', '.join(paths)}")
+
+        self.media_output_paths = paths
+        return paths
 
     def embed_audio(self, audio):
         """Embeds Audio to media"""
@@ -219,51 +285,109 @@ class Video:
 
         :codec: str: options is: av1, h265
         :color_depth: str: options is: 10bit, 8bit
-        :resolution: str: options is: 720, 480
+        :resolution: str: options is: 1080, 720, 480
         :preset: str: the faster preset the less quality and larger file size. options is: faster, fast, medium, slow, slower, veryslow
         :crf: int: the lowest crf the highest quality and larger file size. options is a range of 0-51
         :frame_rate: int: video fps. if not provided it will use videos default fps
+        :processor: str: options is: cpu, gpu, auto. auto uses the fastest encoder measured on this machine
+        :threads: int: forces encoder threads, by default the fastest measured setting for the current jobs count
         """
         if len(kwargs) == 0:
             sys.exit("specify at least one keyword argument for encoding")
 
+        options, scale = self.encode_options(kwargs)
+        self.output_options.update(options)
+        if scale:
+            self.video_stream = self.video_stream.filter('scale', *scale)
+            self._scale = scale
+        self._threads = kwargs.get("threads") or self._threads
+
+        return self
+
+    @classmethod
+    def encode_options(cls, kwargs):
+        """Translates encode keyword arguments into ffmpeg output options and a (width, height) scale"""
+        options = {}
         processor = kwargs.get("processor") or "cpu"
+        scale = cls.resolutions.get(str(kwargs.get("resolution"))) if "resolution" in kwargs else None
         if "codec" in kwargs:
-            codec = kwargs.get("codec")
-            if codec == "h265":
-                if processor == "cpu":
-                    self.output_options["vcodec"] = "libx265"
-                else:
-                    self.output_options["vcodec"] = "hevc_nvenc"
-            elif codec == "av1":
-                if processor == "cpu":
-                    self.output_options["vcodec"] = "libaom-av1"
-                else:
-                    self.output_options["vcodec"] = "libsvtav1"
+            options["vcodec"] = Tuning().encoder(kwargs.get("codec"), processor, scale[1] if scale else None,
+                                                 kwargs.get("preset"))
         if "color_depth" in kwargs:
             color_depth = kwargs.get("color_depth")
             if color_depth == "10bit":
-                if processor == "cpu":
-                    self.output_options["pix_fmt"] = "yuv420p10le"
+                if Tuning.is_hardware(options.get("vcodec")):
+                    options["pix_fmt"] = "p010le"
                 else:
-                    self.output_options["pix_fmt"] = "p010le"
+                    options["pix_fmt"] = "yuv420p10le"
             elif color_depth == "8bit":
-                self.output_options["pix_fmt"] = "yuv420p"
-        if "resolution" in kwargs:
-            resolution = kwargs.get("resolution")
-            if resolution == "720":
-                self.video_stream = self.video_stream.filter('scale', 1280, 720)
-            elif resolution == "480":
-                self.video_stream = self.video_stream.filter('scale', 854, 480)
+                options["pix_fmt"] = "yuv420p"
         if "preset" in kwargs:
-            self.output_options["preset"] = kwargs.get("preset")
+            options["preset"] = kwargs.get("preset")
         if "crf" in kwargs:
-            self.output_options["crf"] = kwargs.get("frame_rate")
+            options["crf"] = kwargs.get("crf")
         if "frame_rate" in kwargs:
-            self.output_options["r"] = kwargs.get("frame_rate")
+            options["r"] = kwargs.get("frame_rate")
 
+        return options, scale
+
+    def ladder(self, renditions):
+        """Encodes several renditions in one ffmpeg run
+
+        the source is decoded once and the shared filters (trim, watermark, hardcode_subtitle)
+        run once before the video is split into every rendition.
+
+        :renditions: list: encode keyword arguments per rendition
+            e.g: [{"resolution": "480", "crf": 30}, {"resolution": "720"}, {"resolution": "1080", "color_depth": "10bit"}]
+        outputs are named after the output path with the resolution appended e.g: test_720p.mkv
+        """
+        if len(renditions) == 0:
+            sys.exit("specify at least one rendition for the ladder")
+        self.filter = True
+        self._ladder = [dict(rendition) for rendition in renditions]
         return self
 
+    def ladder_command(self):
+        count = len(self._ladder)
+        video_streams = self.video_stream.filter_multi_output('split', count)
+        if self._trim:
+            audio_streams = self.audio_stream.filter_multi_output('asplit', count)
+        else:
+            audio_streams = [self.audio_stream] * count
+
+        name = self.utils.remove_file_extension(self.media_output_path)
+        extension = self.utils.get_file_extension(self.media_output_path)
+        self.media_output_paths = []
+        outputs = []
+        for i, rendition in enumerate(self._ladder):
+            options, scale = self.encode_options(rendition)
+            video_stream = video_streams[i]
+            if scale:
+                video_stream = video_stream.filter('scale', *scale)
+
+            output_options = {**self.output_options, **options}
+            if output_options.get("vcodec") == "copy":
+                output_options.pop("vcodec")
+            # renditions share the process, split the cores between them
+            output_options.update(Tuning().options(
+                output_options.get("vcodec"), scale[1] if scale else self.source_height(),
+                output_options.get("preset"), self.jobs * count, rendition.get("threads")
+            ))
+            if i > 0:
+                # -progress is global, one report covers every rendition
+                output_options.pop("progress", None)
+
+            suffix = f"{rendition['resolution']}p" if "resolution" in rendition else str(i + 1)
+            output_path = f"{name}_{suffix}.{extension}"
+            self.media_output_paths.append(output_path)
+
+            output_streams = [video_stream, audio_streams[i]]
+            if self.subtitle_streams and len(self.subtitle_streams) > 0:
+                output_streams.extend(self.subtitle_streams)
+            outputs.append(ffmpeg.output(*output_streams, output_path, **output_options))
+
+        return ffmpeg.merge_outputs(*outputs)
+
     def chapter(self):
         pass
         # ;FFMETADATA1
@@ -280,11 +404,208 @@ class Video:
         # title = Chapter
         # 2
 
-    def trim(self, start, end):
-        self.filter = True
-        self._trim = {"start": start, "end": end}
+    def trim(self, start, end, smart=False):
+        """Cuts media from start to end (seconds)
+
+        :smart: bool: stream-copies the GOPs between the keyframes around start and end and re-encodes
+            only the partial GOPs at the edges. used when nothing else re-encodes the video (h264/hevc sources,
+            no filters, encode, ladder or chunked), otherwise the media is trimmed by the filters as usual
+        """
+        self._trim = {"start": start, "end": end, "smart": smart}
+        if not smart:
+            self.filter = True
         return self
 
+    def smart_trim_possible(self):
+        """True when only the source streams are cut, nothing is filtered, encoded or embedded"""
+        source = ffmpeg.input(self.media_path)
+        source_subtitles = [source[str(stream['index'])] for stream in self.video_info['streams']
+                            if stream['codec_type'] == 'subtitle']
+        return (
+            not self.filter and not self._ladder and not self._chunked and not self._frame
+            and self.output_options.get("vcodec", "copy") == "copy"
+            and self.source_codec() in self.smart_trim_encoders
+            and self.video_stream == source.video and self.audio_stream in (source.audio, None)
+            and all(stream in source_subtitles for stream in self.subtitle_streams)
+        )
+
+    def source_codec(self):
+        for stream in self.video_info['streams']:
+            if stream['codec_type'] == 'video':
+                return stream.get('codec_name')
+        return None
+
+    def keyframe_times(self):
+        """Keyframe timestamps relative to the start of the file, the way -ss counts them"""
+        offset = float(self.video_info['format'].get('start_time', 0) or 0)
+        return [keyframe - offset for keyframe in ProbeCache().keyframes(self.media_path)]
+
+    def frame_duration(self):
+        for stream in self.video_info['streams']:
+            if stream['codec_type'] == 'video':
+                numerator, _, denominator = stream.get('avg_frame_rate', '0/0').partition("/")
+                if float(numerator or 0) and float(denominator or 0):
+                    return float(denominator) / float(numerator)
+        return 0.04
+
+    def smart_trim_pieces(self, start, end):
+        """(start, end, copy) ranges: re-encoded head up to the first keyframe, copied GOPs, re-encoded tail
+
+        like -ss the cut keeps the frames from start on, a head without a whole frame is dropped and
+        keyframes within half a frame of start or end are cut on directly.
+        """
+        frame_duration = self.frame_duration()
+        tolerance = frame_duration / 2
+        keyframes = [keyframe for keyframe in self.keyframe_times() if start - tolerance <= keyframe <= end + tolerance]
+        if len(keyframes) < 2:
+            return [(start, end, False)]
+
+        pieces = []
+        first, last = keyframes[0], keyframes[-1]
+        if first - start >= frame_duration - 0.001:
+            pieces.append((start, first, False))
+        pieces.append((first, last, True))
+        if end - last >= tolerance:
+            pieces.append((last, end, False))
+        return pieces
+
+    def first_packet_time(self, seek):
+        """Timestamp of the video packet ffmpeg lands on when seeking the input to seek"""
+        output, _ = (
+            ffmpeg
+            .input(self.media_path, ss=f"{seek:.6f}")
+            .video
+            .output("pipe:", vcodec="copy", vframes=1, f="framemd5")
+            .global_args("-copyts")
+            .run(capture_stdout=True, quiet=True)
+        )
+        time_base = 1
+        for line in output.decode('utf-8', errors='ignore').splitlines():
+            if line.startswith("#tb 0:"):
+                numerator, denominator = line.split(":", 1)[1].strip().split("/")
+                time_base = int(numerator) / int(denominator)
+            elif line and not line.startswith("#"):
+                offset = float(self.video_info['format'].get('start_time', 0) or 0)
+                return int(line.split(",")[2]) * time_base - offset
+        raise ValueError(f"no video packet found after {seek} in {self.media_path}")
+
+    def copy_gops(self, start, end, pieces_dir, bitstream_filter, report):
+        """Stream-copies the GOPs from keyframe start up to keyframe end into a single piece
+
+        seeking isn't packet exact with stream copy (the demuxer lands on an earlier keyframe and -t cuts on dts),
+        so the range is split by the segment muxer exactly at the two keyframes. its split times count from
+        the packet the seek landed on, the GOPs wanted are the segment after the start split.
+        """
+        seek = max(start - 1, 0)
+        landed = self.first_packet_time(seek)
+        keyframes = [keyframe for keyframe in self.keyframe_times() if landed - 0.001 <= keyframe <= end + 0.001]
+        split_times = []
+        for i, keyframe in enumerate(keyframes[1:], 1):
+            if abs(keyframe - start) < 0.001 or abs(keyframe - end) < 0.001:
+                # a quarter GOP early, the split happens on the keyframe whatever the packets' dts
+                split_times.append(keyframe - landed - (keyframe - keyframes[i - 1]) / 4)
+
+        output_options = {"vcodec": "copy", "progress": "pipe:1", "f": "segment", "segment_format": "matroska",
+                          "reset_timestamps": 1, "bsf:v": bitstream_filter}
+        if split_times:
+            output_options["segment_times"] = ",".join(f"{split_time:.6f}" for split_time in split_times)
+        command = (
+            ffmpeg
+            .input(self.media_path, ss=f"{seek:.6f}", t=f"{end - seek + 1:.6f}")
+            .video
+            .output(os.path.join(pieces_dir, "gops_%03d.mkv"), **output_options)
+            .global_args("-copyts")
+        )
+        if Progress([ProgressCallback(report)]).run(command, quiet=self.show_ffmpeg_log) != 0:
+            raise ValueError(f"ffmpeg failed to copy {start}-{end} from {self.media_path}")
+
+        return os.path.join(pieces_dir, f"gops_{1 if start - landed > 0.001 else 0:03}.mkv")
+
+    def execute_smart_trim(self, progress_bar=True):
+        start = self._trim['start']
+        end = min(self._trim['end'], self.media_duration)
+        pieces_dir = f"{self.utils.remove_file_extension(self.media_output_path)}_pieces_{self.utils.generate_random_name()}"
+        self.utils.check_folder(pieces_dir)
+
+        source = next(stream for stream in self.video_info['streams'] if stream['codec_type'] == 'video')
+        vcodec, params_option, bitstream_filter = self.smart_trim_encoders[source['codec_name']]
+        # every piece carries its own parameter sets in band, copied and re-encoded GOPs then concat cleanly.
+        # the encoders already output annex b, the bitstream filter only converts the copied GOPs
+        encode_options = {"vcodec": vcodec, "pix_fmt": source.get('pix_fmt'), "crf": 16,
+                          **Tuning().options(vcodec, source.get('height'), None, self.jobs)}
+        encode_options[params_option] = ":".join(filter(None, [encode_options.get(params_option), "repeat-headers=1"]))
+
+        frame_duration = self.frame_duration()
+        sinks = [ProgressBar(end - start, self.media_output_path)] if progress_bar else []
+        done = 0
+        try:
+            pieces = []
+            for i, (piece_start, piece_end, copy) in enumerate(self.smart_trim_pieces(start, end)):
+
+                def report(event, offset=done):
+                    if event["out_time"] is not None:
+                        for sink in sinks:
+                            sink.update({"out_time": offset + max(event["out_time"], 0), "speed": None})
+
+                if copy:
+                    pieces.append((self.copy_gops(piece_start, piece_end, pieces_dir, bitstream_filter, report),
+                                   piece_end - piece_start))
+                else:
+                    piece_path = os.path.join(pieces_dir, f"edge_{i}.mkv")
+                    # trim on timestamps (-t counts from the first decoded frame), the frame sitting
+                    # exactly on piece_end belongs to the next piece
+                    duration = piece_end - piece_start
+                    command = (
+                        ffmpeg
+                        .input(self.media_path, ss=f"{piece_start:.6f}", t=f"{duration + 1:.6f}")
+                        .video
+                        .trim(end=f"{duration - 0.001:.6f}")
+                        .output(piece_path, progress="pipe:1",
+                                **{key: value for key, value in encode_options.items() if value is not None})
+                    )
+                    if Progress([ProgressCallback(report)]).run(command, quiet=self.show_ffmpeg_log) != 0:
+                        raise ValueError(f"ffmpeg failed to encode {piece_path}")
+                    # the frames the piece holds, encoder delay shifts its timestamps and so its probed duration
+                    pieces.append((piece_path, int((piece_end - piece_start) / frame_duration + 0.001) * frame_duration))
+                done += piece_end - piece_start
+
+            list_path = os.path.join(pieces_dir, "pieces.txt")
+            with open(list_path, 'w', encoding='utf-8') as file:
+                for piece_path, piece_duration in pieces:
+                    piece_path = os.path.abspath(piece_path).replace("'", "'\\''")
+                    file.write(f"file '{piece_path}'\nduration {piece_duration:.6f}\n")
+            output_streams = [ffmpeg.input(list_path, f="concat", safe=0).video]
+
+            # audio and soft subtitles are copied with an output side -ss, which drops the packets
+            # the input seek lands on before start
+            if self.audio_stream is not None or self.subtitle_streams:
+                seek = max(start - 1, 0)
+                seeked = ffmpeg.input(self.media_path, ss=f"{seek:.6f}")
+                streams = [seeked.audio] if self.audio_stream is not None else []
+                streams.extend(seeked[stream.selector] for stream in self.subtitle_streams)
+                streams_path = os.path.join(pieces_dir, "streams.mkv")
+                (
+                    ffmpeg
+                    .output(*streams, streams_path, ss=f"{start - seek:.6f}", t=f"{end - start:.6f}", c="copy")
+                    .run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+                )
+                streams_input = ffmpeg.input(streams_path)
+                output_streams.extend(streams_input[str(i)] for i in range(len(streams)))
+
+            output_options = {key: value for key, value in self.output_options.items() if key not in ("threads", "progress")}
+            output_options.update({"vcodec": "copy", "acodec": "copy", "c:s": "copy"})
+            (
+                ffmpeg
+                .output(*output_streams, self.media_output_path, **output_options)
+                .run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+            )
+            for sink in sinks:
+                sink.update({"out_time": end - start, "speed": None})
+        finally:
+            for sink in sinks:
+                sink.close()
+            self.utils.check_folder(pieces_dir, True)
+
     def frame(self, second: int = None):
         self.filter = True
         if not second:
@@ -292,6 +613,91 @@ class Video:
         self._frame = {"start": second, "end": second + 1}
         return self
 
+    def thumbnails(self, timestamps=None, count=10, width=320, sprite=False, columns=5, vtt=False):
+        """Extracts frames at several timestamps in a single ffmpeg run
+
+        every timestamp is an input seeked with -ss, ffmpeg jumps to the keyframe before it
+        and decodes only the rest of that GOP instead of the media up to it like frame() does.
+
+        :timestamps: list: seconds to grab, defaults to count evenly spaced ones
+        :count: int: number of thumbnails when timestamps isn't provided
+        :width: int: thumbnail width, height keeps the aspect ratio
+        :sprite: bool: tiles the thumbnails into a single image, columns per row
+        :vtt: bool: writes a WebVTT index pointing each time range to its thumbnail (#xywh= in the sprite) for scrubbing previews
+        returns the paths written, the vtt last
+        """
+        if timestamps is None:
+            timestamps = [(i + 0.5) * self.media_duration / count for i in range(count)]
+        if len(timestamps) == 0:
+            raise ValueError("specify at least one timestamp for thumbnails")
+        last_frame = max(self.media_duration - self.frame_duration(), 0)
+        timestamps = sorted(min(max(float(timestamp), 0), last_frame) for timestamp in timestamps)
+
+        # a stream can feed a single filter, the frame of a timestamp requested several times is split
+        frames = []
+        for timestamp, repeats in Counter(timestamps).items():
+            frame = (
+                ffmpeg
+                .input(self.media_path, ss=f"{timestamp:.3f}")
+                .video
+                .trim(end_frame=1)
+                .setpts('PTS-STARTPTS')
+                .filter('scale', width, -2)
+                .filter('setsar', 1)
+            )
+            if repeats == 1:
+                frames.append(frame)
+            else:
+                split = frame.filter_multi_output('split', repeats)
+                frames.extend(split[i] for i in range(repeats))
+        base = self.utils.remove_file_extension(self.media_output_path).replace(":", " ")
+        rows = math.ceil(len(frames) / columns)
+        if sprite:
+            paths = [f"{base}_sprite.jpg"]
+            command = (
+                ffmpeg
+                .concat(*frames, v=1, a=0)
+                .filter('tile', f"{columns}x{rows}")
+                .output(paths[0], vframes=1, **{"q:v": 3})
+            )
+        else:
+            paths = [f"{base}_thumb_{i + 1:03}.jpg" for i in range(len(frames))]
+            command = ffmpeg.merge_outputs(*(
+                frame.output(path, vframes=1, **{"q:v": 3}) for frame, path in zip(frames, paths)
+            ))
+        try:
+            command.run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+        except ffmpeg.Error as e:
+            raise ValueError(f"ffmpeg failed to extract thumbnails from {self.media_path}") from e
+
+        if vtt:
+            paths.append(self.thumbnails_vtt(timestamps, paths, columns, rows if sprite else None, f"{base}_thumbnails.vtt"))
+        self.media_output_paths = paths
+        return paths
+
+    def thumbnails_vtt(self, timestamps, paths, columns, rows, vtt_path):
+        """Cue i runs from halfway after the previous thumbnail to halfway before the next one"""
+        bounds = [0] + [(current + following) / 2 for current, following in zip(timestamps, timestamps[1:])]
+        bounds.append(self.media_duration)
+
+        if rows:
+            sprite_info = ffmpeg.probe(paths[0], select_streams="v:0")["streams"][0]
+            tile_width, tile_height = sprite_info["width"] // columns, sprite_info["height"] // rows
+
+        lines = ["WEBVTT", ""]
+        for i in range(len(timestamps)):
+            if rows:
+                x, y = i % columns * tile_width, i // columns * tile_height
+                target = f"{os.path.basename(paths[0])}#xywh={x},{y},{tile_width},{tile_height}"
+            else:
+                target = os.path.basename(paths[i])
+            start, end = Timestamp.from_seconds(bounds[i]), Timestamp.from_seconds(bounds[i + 1])
+            lines.extend([f"{Timestamp.format_vtt(start)} --> {Timestamp.format_vtt(end)}", target, ""])
+
+        with open(vtt_path, 'w', encoding='utf-8') as file:
+            file.write("\n".join(lines))
+        return vtt_path
+
     def change_title(self, title):
         """Changes media name and title"""
         title = self.utils.check_extension(title, "mkv")
@@ -308,54 +714,207 @@ class Video:
             os.makedirs(self.move_path)
         return self
 
+    def chunked(self, segments=None, workers=None):
+        """Encodes keyframe aligned segments in parallel ffmpeg processes and joins them losslessly
+
+        :segments: int: number of segments, defaults to twice the workers
+        :workers: int: parallel ffmpeg processes, defaults to cpu count
+        filters see the source timestamps in every segment, so hardcode_subtitle and watermark timing
+        stay correct. audio and soft subtitles are muxed from the source while joining.
+        """
+        self.filter = True
+        workers = workers or os.cpu_count() or 1
+        self._chunked = {"workers": workers, "segments": segments or workers * 2}
+        return self
+
+    def segment_bounds(self, count):
+        """Splits the (trimmed) media into about count (start, end) ranges starting at keyframes"""
+        start = self._trim['start'] if self._trim else 0
+        end = min(self._trim['end'], self.media_duration) if self._trim else self.media_duration
+        target = (end - start) / count
+
+        bounds = [start]
+        for keyframe in ProbeCache().keyframes(self.media_path):
+            if keyframe - bounds[-1] >= target and end - keyframe >= target / 2:
+                bounds.append(keyframe)
+        bounds.append(end)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def execute_chunked(self, progress_bar=True):
+        workers = self._chunked["workers"]
+        bounds = self.segment_bounds(self._chunked["segments"])
+        segments_dir = f"{self.utils.remove_file_extension(self.media_output_path)}_segments_{self.utils.generate_random_name()}"
+        self.utils.check_folder(segments_dir)
+
+        video_options = {
+            key: value for key, value in self.output_options.items()
+            if key not in ("acodec", "c:s", "metadata") and not key.startswith(("metadata:", "disposition:"))
+        }
+        video_options.update(self.thread_options(workers * self.jobs))
+        video_options["progress"] = "pipe:1"
+        # segments keep the source timestamps (-copyts) through the filters and start at 0 in the file
+        video_stream = self.video_stream.setpts('PTS-STARTPTS')
+
+        jobs = []
+        for i, (start, end) in enumerate(bounds):
+            segment_path = os.path.join(segments_dir, f"{i:05}.mkv")
+            args = ffmpeg.output(video_stream, segment_path, **video_options).compile(overwrite_output=True)
+            index = next(j for j, arg in enumerate(args) if arg == "-i" and args[j + 1] == self.media_path)
+            args[index:index] = ["-ss", f"{start:.6f}", "-t", f"{end - start:.6f}"]
+            args.insert(1, "-copyts")
+            jobs.append((segment_path, args))
+
+        sinks = [ProgressBar(bounds[-1][1] - bounds[0][0], self.media_output_path)] if progress_bar else []
+        done = [0] * len(jobs)
+        speeds = []
+        lock = threading.Lock()
+
+        def report(i, event):
+            if event["out_time"] is not None:
+                with lock:
+                    done[i] = max(event["out_time"], 0)
+                    for sink in sinks:
+                        sink.update({"out_time": sum(done), "speed": None})
+
+        def encode_segment(i):
+            progress = Progress([ProgressCallback(lambda event: report(i, event))])
+            if progress.run(jobs[i][1], quiet=self.show_ffmpeg_log) != 0:
+                raise ValueError(f"ffmpeg failed to encode segment {jobs[i][0]}")
+            if progress.last_event and progress.last_event["fps"]:
+                speeds.append(progress.last_event["fps"])
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(encode_segment, i) for i in range(len(jobs))]:
+                    future.result()
+            if speeds:
+                self.record_speed(sum(speeds) / len(speeds), workers * self.jobs, video_options["threads"])
+            for sink in sinks:
+                sink.close()
+
+            list_path = os.path.join(segments_dir, "segments.txt")
+            with open(list_path, 'w', encoding='utf-8') as file:
+                for segment_path, _ in jobs:
+                    segment_path = os.path.abspath(segment_path).replace("'", "'\\''")
+                    file.write(f"file '{segment_path}'\n")
+
+            audio_stream = self.audio_stream
+            if self._trim:
+                audio_stream = audio_stream.filter_('atrim', start=self._trim['start'], end=self._trim['end']).filter_('asetpts', 'PTS-STARTPTS')
+            output_streams = [ffmpeg.input(list_path, f="concat", safe=0).video, audio_stream]
+            if self.subtitle_streams and len(self.subtitle_streams) > 0:
+                output_streams.extend(self.subtitle_streams)
+
+            output_options = {
+                key: value for key, value in self.output_options.items()
+                if key not in ("pix_fmt", "preset", "crf", "r", "progress")
+            }
+            output_options["vcodec"] = "copy"
+            (
+                ffmpeg
+                .output(*output_streams, self.media_output_path, **output_options)
+                .run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+            )
+        finally:
+            self.utils.check_folder(segments_dir, True)
+
     def execute(self, progress_bar=True, async_run=True):
+        if self._trim and self._trim['smart'] and not self.smart_trim_possible():
+            # the cut is re-encoded by the filter graph together with every other step
+            self._trim['smart'] = False
+            self.filter = True
+
         if self.filter:
             if "acodec" in self.output_options:
                 self.output_options.pop("acodec", None)
             if "vcodec" in self.output_options and self.output_options["vcodec"] == "copy":
                 self.output_options.pop("vcodec", None)
 
-        # # add threads based on cpu cores to boost processing speed
-        self.output_options["threads"] = 4
+        if not self._ladder:
+            self.output_options.update(self.thread_options(self.jobs))
 
         try:
-            if progress_bar:
-                self.output_options["progress"] = self.progress_file_path
+            # synchronous runs always report progress, it's how the encoding speed gets measured
+            if progress_bar or not async_run:
+                self.output_options["progress"] = "pipe:1"
+
+            if self._chunked:
+                self.media_output_path = self.media_output_path.replace(":", " ")
+                self.media_output_paths = [self.media_output_path]
+                # segments are encoded synchronously, there is nothing left to wait for
+                self.execute_chunked(progress_bar)
+                async_run = False
+            elif self._trim and self._trim['smart']:
+                self.media_output_path = self.media_output_path.replace(":", " ")
+                self.media_output_paths = [self.media_output_path]
+                self.execute_smart_trim(progress_bar)
+                async_run = False
+            else:
+                self.run_command(progress_bar, async_run)
 
-            if self._trim:
-                self.video_stream = self.video_stream.trim(start=self._trim['start'], end=self._trim['end']).setpts('PTS-STARTPTS')
-                self.audio_stream = self.audio_stream.filter_('atrim', start=self._trim['start'], end=self._trim['end']).filter_('asetpts', 'PTS-STARTPTS')
-            elif self._frame:
-                self.media_output_path = self.utils.check_extension(self.utils.remove_file_extension(self.media_output_path), "png")
-                self.output_options["vframes"] = 1
-                self.output_options["format"] = "image2"
-                self.output_options["update"] = True
-                self.video_stream = self.video_stream.trim(start=self._frame['start'], end=self._frame['end']).setpts('PTS-STARTPTS')
+            if self.move_path:
+                if async_run:
+                    time.sleep(5)
+                for media_output_path in self.media_output_paths:
+                    shutil.move(os.path.abspath(media_output_path), os.path.abspath(self.move_path))
+        except Exception as e:
+            for media_output_path in self.media_output_paths or [self.media_output_path]:
+                self.utils.validate_file(media_output_path, True)
+            raise ValueError(e)
 
+    def run_command(self, progress_bar=True, async_run=True):
+        if self._trim:
+            self.video_stream = self.video_stream.trim(start=self._trim['start'], end=self._trim['end']).setpts('PTS-STARTPTS')
+            self.audio_stream = self.audio_stream.filter_('atrim', start=self._trim['start'], end=self._trim['end']).filter_('asetpts', 'PTS-STARTPTS')
+        elif self._frame:
+            self.media_output_path = self.utils.check_extension(self.utils.remove_file_extension(self.media_output_path), "png")
+            self.output_options["vframes"] = 1
+            self.output_options["format"] = "image2"
+            self.output_options["update"] = True
+            self.video_stream = self.video_stream.trim(start=self._frame['start'], end=self._frame['end']).setpts('PTS-STARTPTS')
+
+        self.media_output_path = self.media_output_path.replace(":", " ")
+
+        if self._ladder:
+            command = self.ladder_command()
+        else:
             output_streams = [self.video_stream, self.audio_stream]
             if self.subtitle_streams and len(self.subtitle_streams) > 0:
                 output_streams.extend(self.subtitle_streams)
-
-            self.media_output_path = self.media_output_path.replace(":", " ")
+            if self._frame:
+                output_streams = [self.video_stream]
 
             command = (
                 ffmpeg
                 .output(*output_streams, self.media_output_path, **self.output_options)
             )
+            self.media_output_paths = [self.media_output_path]
 
-            if async_run:
-                command.run_async(overwrite_output=True, quiet=self.show_ffmpeg_log)
-            else:
-                command.run(overwrite_output=True, quiet=self.show_ffmpeg_log)
+        if async_run and not progress_bar:
+            command.run_async(overwrite_output=True, quiet=self.show_ffmpeg_log)
+            return
 
-            if progress_bar:
-                self.utils.generate_progress_bar(self.media_duration, self.media_output_path, self.progress_file_path)
+        progress = Progress([ProgressBar(self.media_duration, self.media_output_path)] if progress_bar else [])
+        if progress.run(command, quiet=self.show_ffmpeg_log) != 0:
+            raise ValueError(f"ffmpeg failed to process {self.media_output_path}")
+        if progress.last_event and not self._ladder and not self._frame:
+            self.record_speed(progress.last_event["fps"], self.jobs, self.output_options["threads"])
 
-            if self.move_path:
-                if async_run:
-                    time.sleep(5)
-                shutil.move(os.path.abspath(self.media_output_path), os.path.abspath(self.move_path))
-        except Exception as e:
-            self.utils.validate_file(self.media_output_path, True)
-            self.utils.validate_file(self.progress_file_path, True)
-            raise ValueError(e)
+    def source_height(self):
+        for stream in self.video_info['streams']:
+            if stream['codec_type'] == 'video':
+                return stream.get('height')
+        return None
+
+    def output_height(self):
+        return self._scale[1] if self._scale else self.source_height()
+
+    def thread_options(self, jobs):
+        """Encoder threading for this output when jobs encodes share the machine"""
+        return Tuning().options(self.output_options.get("vcodec"), self.output_height(),
+                                self.output_options.get("preset"), jobs, self._threads)
+
+    def record_speed(self, fps, jobs, threads):
+        vcodec = self.output_options.get("vcodec")
+        if fps and vcodec and vcodec != "copy":
+            Tuning().record(vcodec, self.output_height(), self.output_options.get("preset"), jobs, threads, fps)
@@ -0,0 +1,247 @@
+import os
+import time
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from core.utils import Utils
+from core.batch import Batch, run_job
+from core import config
+
+
+class WatchQueue:
+    """Persistent job queue of the watcher, one row per media name and file version (size + mtime)
+
+    statuses are pending, running, done, failed and output (files the pipeline wrote itself).
+    jobs a crash left running are pending again on the next start.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.connection = None
+            cls._instance.path = None
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self, path=None, max_attempts=None):
+        if self.path is None:
+            self.path = config.watcher['queue_path']
+            self.max_attempts = config.watcher['max_attempts']
+        if path and path != self.path:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.path = path
+        if max_attempts:
+            self.max_attempts = max_attempts
+
+    def connect(self):
+        if self.connection is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, status TEXT, attempts INTEGER, "
+                "error TEXT, output TEXT, updated REAL)"
+            )
+            self.connection.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+            self.connection.commit()
+        return self.connection
+
+    def known(self, name, size, mtime):
+        """True when this version of the file is already queued, processed or was written by a job"""
+        with self.lock:
+            row = self.connect().execute("SELECT size, mtime FROM jobs WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def enqueue(self, name, size, mtime, status="pending"):
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (name, size, mtime, status, attempts, error, output, updated) "
+                "VALUES (?, ?, ?, ?, 0, NULL, NULL, ?)",
+                (name, size, mtime, status, time.time())
+            )
+            connection.commit()
+
+    def take(self, limit):
+        """Marks up to limit pending jobs as running, oldest first, and returns their names"""
+        if limit <= 0:
+            return []
+        with self.lock:
+            connection = self.connect()
+            names = [row[0] for row in connection.execute(
+                "SELECT name FROM jobs WHERE status = 'pending' ORDER BY updated LIMIT ?", (limit,)
+            ).fetchall()]
+            connection.executemany(
+                "UPDATE jobs SET status = 'running', updated = ? WHERE name = ?", [(time.time(), name) for name in names]
+            )
+            connection.commit()
+        return names
+
+    def finish(self, name, output=None, error=None):
+        """Records a job result, failed jobs go back to pending until max_attempts"""
+        with self.lock:
+            connection = self.connect()
+            if error:
+                connection.execute(
+                    "UPDATE jobs SET attempts = attempts + 1, error = ?, updated = ?, "
+                    "status = CASE WHEN attempts + 1 < ? THEN 'pending' ELSE 'failed' END WHERE name = ?",
+                    (error, time.time(), self.max_attempts, name)
+                )
+            else:
+                connection.execute(
+                    "UPDATE jobs SET status = 'done', error = NULL, output = ?, updated = ? WHERE name = ?",
+                    (output, time.time(), name)
+                )
+            connection.commit()
+
+    def pending(self):
+        with self.lock:
+            return self.connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self):
+        with self.lock:
+            rows = self.connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class Watcher:
+    """Watches base_path for new media and runs a Batch pipeline on each, on a bounded pool of worker processes
+
+    inotify (optional inotify_simple package) wakes the watcher up as soon as something is written in base_path,
+    without it the folder is polled every poll_interval seconds. a file is queued once its size and mtime didn't
+    change for settle_seconds, so media still being downloaded or copied is left alone. media already in
+    base_path when the watcher starts and isn't in the queue yet is processed too.
+
+    :steps: list: Video steps, defaults to config.watcher['steps']
+    :subtitle_steps: list: Subtitle steps run before, defaults to config.watcher['subtitle_steps']
+    """
+
+    def __init__(self, font_path, fonts_dir, base_path="assets/media", steps=None, subtitle_steps=None,
+                 max_workers=None, settle_seconds=None, poll_interval=None, show_log=False):
+        self.utils = Utils()
+        self.base_path = base_path
+        self.batch = Batch(font_path, fonts_dir, base_path=base_path,
+                           max_workers=max_workers or config.watcher['max_workers'], show_log=show_log)
+        self.steps = config.watcher['steps'] if steps is None else steps
+        self.subtitle_steps = config.watcher['subtitle_steps'] if subtitle_steps is None else subtitle_steps
+        self.settle_seconds = config.watcher['settle_seconds'] if settle_seconds is None else settle_seconds
+        self.poll_interval = poll_interval or config.watcher['poll_interval']
+        self.queue = WatchQueue()
+        self.inotify = None
+        # name: ((size, mtime), monotonic time of the last change seen)
+        self.settling = {}
+
+    def open_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            return None
+
+        inotify = INotify()
+        inotify.add_watch(self.base_path, flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO)
+        return inotify
+
+    def wait(self, timeout):
+        """Sleeps up to timeout seconds (forever when None), with inotify a write in base_path ends it early"""
+        if self.inotify:
+            self.inotify.read(timeout=None if timeout is None else int(timeout * 1000), read_delay=50)
+        else:
+            time.sleep(self.poll_interval if timeout is None else timeout)
+
+    def scan(self, running_names=()):
+        """Queues the media that stopped changing
+
+        outputs of running jobs (named after their media e.g: test_abcdef1234.mkv) are still being written, skip them.
+        """
+        now = time.monotonic()
+        seen = set()
+        running_stems = tuple(f"{os.path.splitext(name)[0]}_" for name in running_names)
+        for entry in os.scandir(self.base_path):
+            if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in config.video_extensions:
+                continue
+            if running_stems and entry.name.startswith(running_stems):
+                continue
+            stat = entry.stat()
+            version = (stat.st_size, stat.st_mtime_ns)
+            seen.add(entry.name)
+            if self.queue.known(entry.name, *version):
+                self.settling.pop(entry.name, None)
+                continue
+
+            previous = self.settling.get(entry.name)
+            if previous is None or previous[0] != version:
+                self.settling[entry.name] = (version, now)
+            elif now - previous[1] >= self.settle_seconds:
+                del self.settling[entry.name]
+                self.queue.enqueue(entry.name, *version)
+                print(f"{self.utils.get_now()} queued {entry.name}")
+
+        for name in set(self.settling) - seen:
+            del self.settling[name]
+
+    def finish(self, name, result):
+        if result["error"]:
+            print(f"{self.utils.get_now()} failed {name}: {result['error']}")
+            self.queue.finish(name, error=result["error"])
+            return
+
+        print(f"{self.utils.get_now()} done {name} -> {result['output']} in {result['elapsed']:.1f}s")
+        self.queue.finish(name, output=result["output"])
+        # outputs written next to the media must not be picked up as new media
+        output = result["output"]
+        if output and os.path.exists(output) and os.path.samefile(os.path.dirname(output), self.base_path):
+            stat = os.stat(output)
+            self.queue.enqueue(os.path.basename(output), stat.st_size, stat.st_mtime_ns, status="output")
+
+    def run(self, once=False):
+        """Watches base_path until interrupted (Ctrl+C)
+
+        :once: bool: returns as soon as nothing is settling, queued or running instead
+        """
+        self.inotify = self.open_inotify()
+        max_workers = self.batch.max_workers
+        print(f"{self.utils.get_now()} watching {self.base_path} ({'inotify' if self.inotify else 'polling'}), "
+              f"{max_workers} workers, queue {self.queue.stats()}")
+
+        running = {}
+        executor = ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1)
+        try:
+            while True:
+                broken = False
+                for future in [future for future in running if future.done()]:
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        # a worker died (e.g: killed out of memory), every job of the pool fails with it
+                        broken = True
+                        result = {"error": f"worker process crashed: {e}"}
+                    self.finish(running.pop(future), result)
+                if broken:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1)
+
+                self.scan(running.values())
+                for name in self.queue.take(max_workers - len(running)):
+                    spec = {**self.batch.job(name, self.steps, self.subtitle_steps), "jobs": max_workers}
+                    running[executor.submit(run_job, spec)] = name
+                    print(f"{self.utils.get_now()} started {name}")
+
+                if once and not running and not self.settling and not self.queue.pending():
+                    break
+                # settling files and running jobs are checked every poll_interval, inotify wakes up earlier
+                self.wait(self.poll_interval if running or self.settling else None)
+        except KeyboardInterrupt:
+            print(f"{self.utils.get_now()} stopped, unfinished jobs run again on the next start")
+        finally:
+            executor.shutdown()
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+
+        return self.queue.stats()